@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    JSON codec benchmark.
+
+    Compares the rendering of a typical Siren page with json.dumps and a
+    json_serial closure, as the handlers did before, with the codec. Run it
+    from the folder containing efesto.cfg:
+
+        python benchmarks/codec.py
+"""
+import json
+import sys
+import timeit
+from datetime import datetime
+
+from efesto import Codec
+from efesto.Siren import hinder
+
+
+sys.path.insert(0, '')
+
+
+def make_page(items):
+    data = []
+    for i in range(items):
+        data.append({'id': i, 'name': 'item %s' % (i), 'rank': i % 10,
+                     'price': i * 1.5, 'enabled': True,
+                     'last_login': datetime(2016, 4, 20, 10, 30, i % 60)})
+    return hinder(data, path='/items', page=2, last_page=10)
+
+
+def legacy_dumps(siren):
+    def json_serial(obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        raise TypeError('Type not serializable')
+    return json.dumps(siren, default=json_serial).encode('UTF-8')
+
+
+def benchmark(function, siren, number=200):
+    seconds = timeit.timeit(lambda: function(siren), number=number)
+    return seconds / number * 1000
+
+
+if __name__ == '__main__':
+    codecs = [('json', legacy_dumps), ('stdlib codec', Codec.stdlib_dumps)]
+    if Codec.orjson is not None:
+        codecs.append(('orjson codec', Codec.orjson_dumps))
+    for items in [20, 100, 1000]:
+        siren = make_page(items)
+        results = ['{}: {:.2f}ms'.format(name, benchmark(function, siren))
+                   for name, function in codecs]
+        print('{} items: {}'.format(items, ', '.join(results)))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    Collection rows benchmark.
+
+    Compares building the items of a page from model instances, as
+    collections did before, with reading tuples and serializing them with a
+    RowSerializer. It creates a temporary type with 10000 items, so it needs
+    a configured database. Run it from the folder containing efesto.cfg:
+
+        python benchmarks/rows.py
+"""
+import sys
+import time
+
+from efesto.Base import db
+from efesto.Models import Fields, Types, Users, make_model
+from efesto.Resources import ModelDescriptor, model_columns
+
+
+sys.path.insert(0, '')
+
+
+def legacy_items(model, fields):
+    columns = model_columns(model)
+    items = []
+    for row in model.select():
+        item = {}
+        for column in columns:
+            if column in fields or fields == 'all':
+                item[column] = getattr(row, column)
+        items.append(item)
+    return items
+
+
+def tuple_items(model, fields):
+    descriptor = ModelDescriptor(model)
+    query = model.select().tuples()
+    serializer = descriptor.row_serializer(query, fields)
+    return [serializer.serialize(row) for row in query]
+
+
+def benchmark(function, model, fields, rows):
+    start = time.perf_counter()
+    function(model, fields)
+    return rows / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    rows = 10000
+    owner = Users.select().order_by(Users.id).get()
+    with db.atomic():
+        custom_type = Types.create(name='benchmarkrows', enabled=True)
+        for name, field_type in [('title', 'string'), ('score', 'int'),
+                                 ('price', 'float'), ('created', 'date')]:
+            Fields.create(name=name, type=custom_type.id,
+                          field_type=field_type)
+    model = make_model(custom_type)
+    try:
+        with db.atomic():
+            model.insert_many([{'owner': owner.id, 'title': 'item %s' % (i),
+                                'score': i, 'price': i / 3,
+                                'created': '2016-04-20'}
+                               for i in range(rows)]).execute()
+        for fields in ['all', ['id', 'title']]:
+            before = benchmark(legacy_items, model, fields, rows)
+            after = benchmark(tuple_items, model, fields, rows)
+            print('fields {}: {:.0f} rows/s before, {:.0f} rows/s after'
+                  .format(fields, before, after))
+    finally:
+        model.delete().execute()
+        Fields.delete().where(Fields.type == custom_type.id).execute()
+        custom_type.delete_instance()
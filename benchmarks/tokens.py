@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+    Token verification benchmark.
+
+    Compares the per-request cost of reading a token with the previous
+    read_token, that built two serializers and verified user tokens twice,
+    with the current one. Run it from the folder containing efesto.cfg:
+
+        python benchmarks/tokens.py
+"""
+import sys
+import timeit
+
+from efesto.Auth import generate_token, read_token
+from efesto.Base import config
+from itsdangerous import (JSONWebSignatureSerializer as Serializer,
+                          TimedJSONWebSignatureSerializer as TimedSerializer)
+
+
+sys.path.insert(0, '')
+
+
+def legacy_read_token(token):
+    s = Serializer(config.parser.get('security', 'secret'))
+    result = s.loads(token)
+    if 'user' in result:
+        t = TimedSerializer(config.parser.get('security', 'secret'))
+        return t.loads(token)
+    return result
+
+
+def benchmark(function, token, number=20000):
+    seconds = timeit.timeit(lambda: function(token), number=number)
+    return seconds / number * 1000000
+
+
+if __name__ == '__main__':
+    tokens = [('user token', generate_token(user='benchmark')),
+              ('eternal token', generate_token(token='benchmark'))]
+    for name, token in tokens:
+        before = benchmark(legacy_read_token, token)
+        after = benchmark(read_token, token)
+        print('{}: {:.1f}us before, {:.1f}us after'.format(name, before,
+                                                           after))
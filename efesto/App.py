@@ -20,30 +20,36 @@
 import falcon
 from falcon_cors import CORS
 
-from .Base import config
-from .Models import (AccessRules, EternalTokens, Fields, Types, Users,
-                     make_model)
-from .Resources import (RootResource, TokensResource, make_collection,
-                        make_resource)
+from .Base import settings
+from .Crypto import hashers
+from .Models import (AccessRules, EternalTokens, Fields, Indexes, Types,
+                     Users, make_model, upgrade_tables)
+from .Resources import (RootResource, StatsResource, TokensResource,
+                        make_collection, make_resource)
 from .Version import __version__
 
 
 cors = CORS(
-    allow_all_origins=config.parser.getboolean('cors', 'all_origins'),
-    allow_all_methods=config.parser.getboolean('cors', 'all_methods'),
-    allow_all_headers=config.parser.getboolean('cors', 'all_headers'),
-    allow_credentials_all_origins=config.parser.getboolean('cors',
-                                                           'all_credentials')
+    allow_all_origins=settings.cors.all_origins,
+    allow_all_methods=settings.cors.all_methods,
+    allow_all_headers=settings.cors.all_headers,
+    allow_credentials_all_origins=settings.cors.all_credentials
 )
 
-if config.parser.getboolean('main', 'installed'):
+if settings.security.algorithm not in hashers:
+    raise ValueError('Unknown hashing algorithm %s' %
+                     (settings.security.algorithm))
+
+if settings.main.installed:
+    upgrade_tables()
     app = falcon.API(middleware=[cors.middleware])
     root_message = 'Running efesto %s' % (__version__)
     root_data = {'message': root_message}
     app.add_route('/', RootResource(root_data))
 
     for i in [['/users', Users], ['/types', Types], ['/fields', Fields],
-              ['/rules', AccessRules], ['/tokens', EternalTokens]]:
+              ['/indexes', Indexes], ['/rules', AccessRules],
+              ['/tokens', EternalTokens]]:
         collection = make_collection(i[1])()
         resource = make_resource(i[1])()
         app.add_route(i[0], collection)
@@ -59,6 +65,7 @@ if config.parser.getboolean('main', 'installed'):
         app.add_route('/%s/{id}' % (model_name), resource)
 
     app.add_route('/auth', TokensResource())
+    app.add_route('/stats', StatsResource())
 
     def error_serializer(req, exception):
         preferred = 'application/json'
@@ -18,45 +18,161 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import base64
-from itsdangerous import (JSONWebSignatureSerializer as Serializer,
+import time
+from threading import Lock
+from itsdangerous import (BadHeader, BadSignature,
+                          JSONWebSignatureSerializer as Serializer,
+                          SignatureExpired,
                           TimedJSONWebSignatureSerializer as TimedSerializer)
+from playhouse.signals import post_delete, post_save
 
-from .Base import config
-from .Crypto import compare_hash
-from .Models import EternalTokens, Users
+from .Base import settings
+from .Cache import Cache
+from .Crypto import compare_hash, generate_hash, hashing_pool, needs_rehash
+from .Models import EternalTokens, RevokedTokens, Users
+
+
+principals_cache = Cache(settings.cache.principals,
+                         ttl=settings.cache.principals_ttl)
+tokens_cache = Cache(settings.cache.tokens, ttl=settings.cache.principals_ttl)
+users_cache = Cache(settings.cache.users,
+                    ttl=settings.security.revocations_refresh)
+
+
+class Revocations(object):
+    """
+    The latest revoked generation of each eternal token whose stateless
+    tokens have been revoked. They are loaded from RevokedTokens and
+    refreshed incrementally, at most every refresh seconds, so that
+    revocations made by other processes are seen within that delay.
+    """
+    def __init__(self, refresh=30):
+        self.refresh = refresh
+        self.tokens = {}
+        self.last_id = 0
+        self.last_refresh = None
+        self.lock = Lock()
+
+    def load(self):
+        """
+        Loads the revocations recorded since the last load.
+        """
+        query = RevokedTokens.select(RevokedTokens.id, RevokedTokens.token,
+                                     RevokedTokens.generation)\
+            .where(RevokedTokens.id > self.last_id)\
+            .order_by(RevokedTokens.id.asc())\
+            .tuples()
+        for revocation_id, token, generation in query:
+            self.add(token, generation)
+            self.last_id = revocation_id
+        self.last_refresh = time.time()
+
+    def add(self, token, generation=0):
+        if generation > self.tokens.get(token, -1):
+            self.tokens[token] = generation
+
+    def revoked(self, token, generation=0):
+        """
+        Tells whether the stateless tokens of the given generation of an
+        eternal token have been revoked.
+        """
+        with self.lock:
+            if (self.last_refresh is None or
+                    time.time() - self.last_refresh > self.refresh):
+                self.load()
+        return generation <= self.tokens.get(token, -1)
+
+
+revocations = Revocations(settings.security.revocations_refresh)
+
+
+def make_verifiers(secrets):
+    """
+    Builds a serializer and its signer for each secret. The first one is the
+    current secret, the others are previous secrets that are still accepted
+    when reading tokens.
+    """
+    verifiers = []
+    for secret in secrets:
+        serializer = Serializer(secret)
+        verifiers.append((serializer, serializer.make_signer()))
+    return verifiers
+
+
+verifiers = make_verifiers((settings.security.secret,) +
+                           settings.security.previous_secrets)
+timed_serializers = {}
 
 
 def generate_token(expiration=600, **kwargs):
-    s = TimedSerializer(config.parser.get('security', 'secret'),
-                        expires_in=expiration)
+    if expiration not in timed_serializers:
+        timed_serializers[expiration] = TimedSerializer(
+            settings.security.secret, expires_in=expiration)
+    s = timed_serializers[expiration]
     return s.dumps(kwargs).decode('UTF-8')
 
 
-def read_token(token):
+def unsign_token(token):
+    """
+    Verifies the signature of a token with the current secret, falling back
+    to the previous secrets. Returns the serializer that verified the token
+    and the signed payload.
+    """
+    if isinstance(token, str):
+        token = token.encode('UTF-8')
+    error = None
+    for serializer, signer in verifiers:
+        try:
+            return serializer, signer.unsign(token)
+        except BadSignature as e:
+            error = e
+    raise error
+
+
+def read_token(token, return_header=False):
     """
-    Reads a token. If the token contains a user parameter, the token is read
-    with TimedSerializer.
+    Reads a token. The signature is verified only once; if the token contains
+    a user parameter, its expiration is checked too, like TimedSerializer
+    does.
     """
-    s = Serializer(config.parser.get('security', 'secret'))
-    result = s.loads(token)
+    serializer, payload = unsign_token(token)
+    result, header = serializer.load_payload(payload, return_header=True)
+    if header.get('alg') != serializer.algorithm_name:
+        raise BadHeader('Algorithm mismatch', header=header, payload=result)
     if 'user' in result:
-        t = TimedSerializer(config.parser.get('security', 'secret'))
-        return t.loads(token)
-    else:
-        return result
+        if not isinstance(header.get('exp'), int) or header['exp'] <= 0:
+            raise BadSignature('Missing expiry date', payload=result)
+        if header['exp'] < int(time.time()):
+            raise SignatureExpired('Signature expired', payload=result)
+    if return_header:
+        return result, header
+    return result
 
 
 def authenticate_by_password(username, password):
     """
     Authenticates a user by username and password. Usually this occurs only
-    when an user needs a token.
+    when an user needs a token. If the password was hashed with an outdated
+    algorithm or work factor, it's hashed again; a failed rehash leaves the
+    old hash in place and doesn't affect the login.
+
+    Hashing runs in the hashing pool, so HashingPoolFull is raised when the
+    pool is saturated.
     """
     try:
         user = Users.get(Users.name == username, Users.enabled == True)
     except:
         return None
 
-    if compare_hash(password, user.password):
+    if hashing_pool.run(compare_hash, password, user.password):
+        if needs_rehash(user.password):
+            try:
+                new_hash = hashing_pool.run(generate_hash, password)
+                Users.update(password=new_hash)\
+                    .where(Users.id == user.id).execute()
+                user._data['password'] = new_hash
+            except Exception:
+                pass
         return user
 
 
@@ -67,26 +183,135 @@ def parse_auth_header(auth_string):
     return base64.b64decode(auth_string.split()[1]).decode('latin-1')
 
 
+def authenticate_by_eternal_token(auth_token):
+    """
+    Finds the enabled user that owns an eternal token. The token and its user
+    are fetched with a single query on the unique token index, and the
+    result is cached.
+    """
+    user = tokens_cache.get(auth_token)
+    if user is not None:
+        return user
+    try:
+        token = EternalTokens.select(EternalTokens, Users)\
+            .join(Users)\
+            .where(EternalTokens.token == auth_token)\
+            .get()
+    except EternalTokens.DoesNotExist:
+        return None
+    if token.user.enabled == True:
+        tokens_cache.set(auth_token, token.user)
+        return token.user
+    return None
+
+
+def get_user(user_id):
+    """
+    Gets an enabled user by id, caching it for security.revocations_refresh
+    seconds, so that users disabled by other processes are refused within
+    the same delay as revoked tokens.
+    """
+    user = users_cache.get(user_id)
+    if user is not None:
+        return user
+    try:
+        user = Users.get(Users.id == user_id, Users.enabled == True)
+    except Users.DoesNotExist:
+        return None
+    users_cache.set(user_id, user)
+    return user
+
+
+def authenticate_by_stateless_token(auth_dict):
+    """
+    Authenticates a stateless eternal token, that carries its user id and the
+    id and generation of its eternal token. Instead of looking up the eternal
+    token, the token is checked against the revocations. Tokens issued before
+    generations were signed count as generation 0.
+    """
+    if revocations.revoked(auth_dict['tid'], auth_dict.get('gen', 0)):
+        return None
+    return get_user(auth_dict['uid'])
+
+
 def authenticate_by_token(auth_header):
     """
-    Authenticates a user with a token or an eternal token.
+    Authenticates a user with a token or an eternal token. Successful
+    authentications are cached until the token expires, up to the
+    cache.principals_ttl. Stateless tokens are cached for at most
+    security.revocations_refresh, so that revocations and disabled users
+    are seen within that delay.
     """
+    user = principals_cache.get(auth_header)
+    if user is not None:
+        return user
+
     try:
         parsed = parse_auth_header(auth_header)
-        auth_dict = read_token(parsed.split(':')[1])
+        auth_dict, header = read_token(parsed.split(':')[1],
+                                       return_header=True)
     except:
         return None
 
+    expires = None
     if 'token' in auth_dict:
-        auth_token = auth_dict['token']
-        token = EternalTokens.get(EternalTokens.token == auth_token)
-        if token.user.enabled == True:
-            return token.user
-        return None
+        user = authenticate_by_eternal_token(auth_dict['token'])
+    elif 'tid' in auth_dict:
+        user = authenticate_by_stateless_token(auth_dict)
+        expires = time.time() + settings.security.revocations_refresh
     else:
         try:
             user = Users.get(Users.name == auth_dict['user'],
                              Users.enabled == True)
         except:
             user = None
-        return user
+        expires = header['exp']
+
+    if user is not None:
+        principals_cache.set(auth_header, user, expires=expires)
+    return user
+
+
+@post_save(sender=Users)
+def on_principal_save(model_class, instance, created):
+    """
+    Removes the cached authentications of an user when it's changed, so that
+    disabling an user takes effect immediately.
+    """
+    principals_cache.invalidate(lambda key, value: value.id == instance.id)
+    tokens_cache.invalidate(lambda key, value: value.id == instance.id)
+    users_cache.delete(instance.id)
+
+
+@post_delete(sender=Users)
+def on_principal_delete(model_class, instance):
+    """
+    Removes the cached authentications of a deleted user.
+    """
+    principals_cache.invalidate(lambda key, value: value.id == instance.id)
+    tokens_cache.invalidate(lambda key, value: value.id == instance.id)
+    users_cache.delete(instance.id)
+
+
+@post_delete(sender=EternalTokens)
+def on_token_delete(model_class, instance):
+    """
+    Removes the cached authentications of the owner of a revoked token.
+    """
+    revocations.add(instance.id, instance.generation)
+    tokens_cache.delete(instance.token)
+    principals_cache.invalidate(lambda key, value:
+                                value.id == instance.user_id)
+
+
+@post_save(sender=EternalTokens)
+def on_token_post_save(model_class, instance, created):
+    """
+    Clears the cached authentications when an eternal token is changed,
+    since its previous value is no longer known, and revokes the generations
+    before the current one in this process without waiting for a refresh.
+    """
+    if not created:
+        revocations.add(instance.id, instance.generation - 1)
+        tokens_cache.clear()
+        principals_cache.clear()
@@ -17,17 +17,133 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from peewee import PostgresqlDatabase
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
 
+from playhouse.postgres_ext import PostgresqlExtDatabase
 
+
+from .Codec import loads
 from .Config import Config
 
 config = Config()
+settings = config.settings
+logger = logging.getLogger('efesto')
+
+
+class QueryContext(threading.local):
+    """
+    The route and user of the queries run by a thread, the plans of the
+    queries when they are being explained, and whether a statement timeout
+    is set or kept after its block.
+    """
+    route = None
+    user = None
+    plans = None
+    timeout = None
+
+
+class Database(PostgresqlExtDatabase):
+    """
+    The Postgres database. Reads made in a query context, that is by
+    collection requests, are logged when slower than the db.slow_query
+    option, with the route and the user that ran them. Parameters are left
+    out of the log, since they can carry tokens or other secrets.
+    """
+    def __init__(self, *args, **kwargs):
+        super(Database, self).__init__(*args, **kwargs)
+        self.context = QueryContext()
+
+    @contextmanager
+    def query_context(self, route, user, explain=False):
+        """
+        Sets the route and user of the queries run in the block. When
+        explain is true, the plans of the SELECT queries are recorded in the
+        list given by the block.
+        """
+        plans = [] if explain else None
+        self.context.route = route
+        self.context.user = user
+        self.context.plans = plans
+        try:
+            yield plans
+        finally:
+            self.context.route = None
+            self.context.user = None
+            self.context.plans = None
+
+    @contextmanager
+    def statement_timeout(self):
+        """
+        Cancels the queries of the block that take longer than the
+        db.statement_timeout option. A cancelled query aborts the current
+        transaction, so outside transactions it's rolled back, leaving the
+        connection usable.
+
+        Streams that keep reading after the block can keep the timeout with
+        keep_statement_timeout, and reset it when they are done.
+        """
+        timeout = settings.db.statement_timeout
+        if timeout < 1:
+            yield
+            return
+        self.execute_sql('SET statement_timeout = %s', (timeout, ))
+        self.context.timeout = 'set'
+        try:
+            yield
+        except Exception:
+            if self.transaction_depth() == 0:
+                self.rollback()
+            raise
+        finally:
+            if self.context.timeout != 'kept':
+                self.reset_statement_timeout()
+
+    def keep_statement_timeout(self):
+        """
+        Keeps the statement timeout of the current block after the block
+        ends. Returns whether there's a timeout to reset later.
+        """
+        if self.context.timeout != 'set':
+            return False
+        self.context.timeout = 'kept'
+        return True
+
+    def reset_statement_timeout(self):
+        self.context.timeout = None
+        self.execute_sql('RESET statement_timeout')
+
+    def explain(self, sql, params):
+        cursor = super(Database, self).execute_sql(
+            'EXPLAIN (FORMAT JSON) %s' % (sql), params, require_commit=False)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = loads(plan)
+        self.context.plans.append({'sql': sql, 'params': list(params or []),
+                                   'plan': plan})
+
+    def execute_sql(self, sql, params=None, require_commit=True,
+                    named_cursor=False):
+        read = self.context.route is not None and sql.startswith('SELECT')
+        if read and self.context.plans is not None:
+            self.explain(sql, params)
+        start = perf_counter()
+        cursor = super(Database, self).execute_sql(
+            sql, params, require_commit, named_cursor=named_cursor)
+        elapsed = (perf_counter() - start) * 1000
+        if read and 0 < settings.db.slow_query <= elapsed:
+            logger.warning('Slow query (%.1f ms) on %s by user %s: %s',
+                           elapsed, self.context.route, self.context.user,
+                           sql)
+        return cursor
 
 
-db = PostgresqlDatabase(
-    config.parser.get('db', 'name'),
-    user=config.parser.get('db', 'user'),
-    password=config.parser.get('db', 'password'),
-    host=config.parser.get('db', 'host')
+db = Database(
+    settings.db.name,
+    user=settings.db.user,
+    password=settings.db.password,
+    host=settings.db.host,
+    register_hstore=False
 )
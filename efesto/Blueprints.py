@@ -20,7 +20,7 @@
 import os
 from configparser import ConfigParser
 
-from .Models import Fields, Types
+from .Models import Fields, Indexes, Types
 
 
 def parse_section(parser, field_section, field_dict):
@@ -32,6 +32,19 @@ def parse_section(parser, field_section, field_dict):
         field_dict['field_type'] = parser.get(field_section, 'type')
     if 'nullable' in options:
         field_dict['nullable'] = parser.getboolean(field_section, 'nullable')
+    if 'indexed' in options:
+        field_dict['indexed'] = parser.getboolean(field_section, 'indexed')
+    if 'searchable' in options:
+        field_dict['searchable'] = parser.getboolean(field_section,
+                                                     'searchable')
+
+
+def index_sections(parser, type):
+    """
+    Finds the index sections of a type, named <type>.index.<name>.
+    """
+    prefix = '{}.index.'.format(type)
+    return [i for i in parser.sections() if i.startswith(prefix)]
 
 
 def write_field(type, field, parser):
@@ -44,6 +57,10 @@ def write_field(type, field, parser):
         special_values['type'] = field.field_type
     if field.nullable == False:
         special_values['nullable'] = field.nullable
+    if field.indexed:
+        special_values['indexed'] = field.indexed
+    if field.searchable:
+        special_values['searchable'] = field.searchable
 
     if len(special_values) > 0:
         field_section = '{}.{}'.format(type.name, field.name)
@@ -55,6 +72,17 @@ def write_field(type, field, parser):
         parser.set(field_section, 'type', field.field_type)
 
 
+def write_index(type, index, parser):
+    """
+    Writes an index of a type in the blueprint file.
+    """
+    index_section = '{}.index.{}'.format(type.name, index.name)
+    parser.add_section(index_section)
+    parser.set(index_section, 'columns', index.columns)
+    if index.unique:
+        parser.set(index_section, 'unique', str(index.unique))
+
+
 def load_blueprint(blueprint, mode='default'):
     """
     Loads a blueprint in to the database from a blueprint file.
@@ -85,6 +113,13 @@ def load_blueprint(blueprint, mode='default'):
                 parse_section(parser, field_section, field_dict)
             new_field = Fields(**field_dict)
             new_field.save()
+        for index_section in index_sections(parser, type):
+            index = Indexes(name=index_section.split('.', 2)[2],
+                            type=new_type.id,
+                            columns=parser.get(index_section, 'columns'))
+            if parser.has_option(index_section, 'unique'):
+                index.unique = parser.getboolean(index_section, 'unique')
+            index.save()
         new_type.enabled = 1
         new_type.save()
 
@@ -103,6 +138,8 @@ def dump_blueprint(blueprint_file):
             write_field(type, field, parser)
             fields_list.append(field.name)
         parser.set(type.name, 'fields', ', '.join(fields_list))
+        for index in Indexes.select().where(Indexes.type == type.id):
+            write_index(type, index, parser)
 
     with open(blueprint_file, 'w') as blueprint:
         parser.write(blueprint)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    The Efesto cache module.
+
+    Copyright (C) 2016 Jacopo Cascioli
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class Cache(object):
+    """
+    A bounded, in-process cache that evicts the least recently used entries.
+    A cache with a size of 0 is disabled and never stores anything.
+
+    When ttl is given, entries expire ttl seconds after being set.
+    """
+    def __init__(self, size=1000, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                value, expires = self.entries[key]
+                if expires is None or expires > time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, expires=None):
+        """
+        Stores a value. The entry expires at the expires timestamp or after
+        the cache ttl, whichever comes first.
+        """
+        if self.size < 1:
+            return
+        if self.ttl is not None:
+            ttl_expires = time.time() + self.ttl
+            if expires is None or ttl_expires < expires:
+                expires = ttl_expires
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate(self, condition):
+        """
+        Removes the entries for which condition(key, value) is true.
+        """
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if condition(key, entry[0])]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the number of stored entries and the hits/misses counters.
+        """
+        return {'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses}
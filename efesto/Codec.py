@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    The Efesto codec module.
+
+    Copyright (C) 2016 Jacopo Cascioli
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj):
+    """
+    Serializes the types that JSON does not support: dates and times become
+    ISO 8601 strings and decimals strings, to keep their precision.
+    """
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError('Type not serializable')
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, default=default).encode('UTF-8')
+
+
+def stdlib_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('UTF-8')
+    return json.loads(data)
+
+
+def orjson_dumps(obj):
+    return orjson.dumps(obj, default=default)
+
+
+def orjson_loads(data):
+    return orjson.loads(data)
+
+
+# orjson is used when installed, falling back to the standard library.
+if orjson is not None:
+    dumps = orjson_dumps
+    loads = orjson_loads
+else:
+    dumps = stdlib_dumps
+    loads = stdlib_loads
@@ -19,6 +19,97 @@
 """
 import configparser
 import os
+from collections import namedtuple
+
+
+def boolean(value):
+    states = configparser.ConfigParser.BOOLEAN_STATES
+    if value.lower() not in states:
+        raise ValueError('%s is not a boolean' % (value))
+    return states[value.lower()]
+
+
+def natural(value):
+    number = int(value)
+    if number < 0:
+        raise ValueError('%s is negative' % (value))
+    return number
+
+
+def positive(value):
+    number = int(value)
+    if number < 1:
+        raise ValueError('%s is not positive' % (value))
+    return number
+
+
+def strings(value):
+    return tuple(i.strip() for i in value.split(',') if i.strip())
+
+
+def choice(*choices):
+    def parse(value):
+        if value not in choices:
+            message = '%s is not one of %s' % (value, ', '.join(choices))
+            raise ValueError(message)
+        return value
+    return parse
+
+
+# The options known to efesto, with the function used to parse them and their
+# default value. Options without a default value are required.
+options = {
+    'main': {
+        'installed': (boolean, 'False')
+    },
+    'db': {
+        'name': (str, None),
+        'user': (str, None),
+        'password': (str, ''),
+        'host': (str, 'localhost'),
+        'slow_query': (natural, '0'),
+        'statement_timeout': (natural, '0')
+    },
+    'security': {
+        'secret': (str, None),
+        'previous_secrets': (strings, ''),
+        'token_expiration': (positive, '3600'),
+        'salt_length': (positive, '8'),
+        'iterations': (positive, '1000'),
+        'key_length': (positive, '24'),
+        'algorithm': (str, 'PBKDF2-256'),
+        'stateless_tokens': (boolean, 'False'),
+        'revocations_refresh': (natural, '30')
+    },
+    'hashing': {
+        'executor': (choice('thread', 'process'), 'thread'),
+        'workers': (positive, '4'),
+        'queue': (natural, '16'),
+        'retry_after': (natural, '1')
+    },
+    'cache': {
+        'permissions': (natural, '1000'),
+        'permissions_ttl': (natural, '60'),
+        'principals': (natural, '1000'),
+        'principals_ttl': (natural, '300'),
+        'tokens': (natural, '1000'),
+        'users': (natural, '1000'),
+        'responses': (natural, '0'),
+        'responses_ttl': (natural, '60')
+    },
+    'collections': {
+        'count': (choice('exact', 'estimate', 'none'), 'exact'),
+        'stream_items': (natural, '1000'),
+        'search_language': (str, 'english'),
+        'max_items': (natural, '0')
+    },
+    'cors': {
+        'all_origins': (boolean, 'False'),
+        'all_methods': (boolean, 'False'),
+        'all_headers': (boolean, 'False'),
+        'all_credentials': (boolean, 'False')
+    }
+}
 
 
 class Config(object):
@@ -27,6 +118,7 @@ class Config(object):
         self.path = self.find_path(config_file)
         self.parser = configparser.ConfigParser()
         self.parser.read(self.path)
+        self.settings = self.compile()
 
     def find_path(self, path):
         """
@@ -43,3 +135,36 @@ class Config(object):
             if os.path.isfile(fullpath):
                 return fullpath
         raise ValueError('The configuration file was not found at %s' % (path))
+
+    def read(self, section, option, default):
+        """
+        Reads the raw value of an option. An environment variable named
+        EFESTO_SECTION_OPTION overrides the configuration file.
+        """
+        variable = 'EFESTO_%s_%s' % (section.upper(), option.upper())
+        if variable in os.environ:
+            return os.environ[variable]
+        value = self.parser.get(section, option, fallback=default)
+        if value is None:
+            raise ValueError('The option %s.%s is missing' % (section, option))
+        return value
+
+    def compile(self):
+        """
+        Parses and validates every option, returning an immutable settings
+        object, e.g. settings.security.iterations. A ValueError is raised for
+        missing or invalid options.
+        """
+        sections = {}
+        for section in options:
+            values = {}
+            for option, (parse, default) in options[section].items():
+                value = self.read(section, option, default)
+                try:
+                    values[option] = parse(value)
+                except ValueError as e:
+                    raise ValueError('Invalid value for %s.%s: %s' %
+                                     (section, option, e))
+            section_tuple = namedtuple(section.capitalize(), values.keys())
+            sections[section] = section_tuple(**values)
+        return namedtuple('Settings', sections.keys())(**sections)
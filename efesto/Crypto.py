@@ -13,18 +13,13 @@
     :license: BSD
 """
 import hashlib
-import hmac
 import os
 from binascii import hexlify
-from itertools import starmap
-from operator import xor
-from struct import Struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore
 
 
-from .Base import config
-
-
-_pack_int = Struct('>I').pack
+from .Base import settings
 
 
 def bytes_(s, encoding='utf8', errors='strict'):
@@ -51,22 +46,12 @@ def pbkdf2_bin(data, salt, iterations=1000, keylen=24, hashfunc=None):
     with the given `salt`.  It iterates `iterations` time and produces a
     key of `keylen` bytes.  By default SHA-1 is used as hash function,
     a different hashlib `hashfunc` can be provided.
+
+    The computation is done by hashlib's C implementation.
     """
     hashfunc = hashfunc or hashlib.sha1
-    mac = hmac.new(bytes_(data), None, hashfunc)
-
-    def _pseudorandom(x, mac=mac):
-        h = mac.copy()
-        h.update(bytes_(x))
-        return [x for x in h.digest()]
-    buf = []
-    for block in range_(1, -(-keylen // mac.digest_size) + 1):
-        rv = u = _pseudorandom(bytes_(salt) + _pack_int(block))
-        for i in range_(iterations - 1):
-            u = _pseudorandom(bytes(u))
-            rv = starmap(xor, zip(rv, u))
-        buf.extend(rv)
-    return bytes(buf)[:keylen]
+    return hashlib.pbkdf2_hmac(hashfunc().name, bytes_(data), bytes_(salt),
+                               iterations, keylen)
 
 
 def safe_str_cmp(a, b):
@@ -78,27 +63,103 @@ def safe_str_cmp(a, b):
     return rv == 0
 
 
+hashers = {}
+
+
+def register_hasher(algorithm, hasher):
+    """
+    Registers a password hasher. A hasher is a function that accepts the
+    string to hash, the salt, the iterations and the key length and returns
+    the hex encoded hash.
+    """
+    hashers[algorithm] = hasher
+
+
+def make_pbkdf2_hasher(hashfunc):
+    def hasher(string_to_hash, salt, iterations, key_length):
+        return pbkdf2_hex(string_to_hash, salt, iterations=iterations,
+                          keylen=key_length, hashfunc=hashfunc)
+    return hasher
+
+
+# PBKDF2-256 is the name historically used by efesto for PBKDF2 with SHA-1.
+register_hasher('PBKDF2-256', make_pbkdf2_hasher(hashlib.sha1))
+register_hasher('PBKDF2-SHA256', make_pbkdf2_hasher(hashlib.sha256))
+register_hasher('PBKDF2-SHA512', make_pbkdf2_hasher(hashlib.sha512))
+
+
 def generate_hash(string_to_hash):
     """ Generates a complete hash, that includes algorithm, iterations, salt
     and hash separated by hash_separator.
 
     E.g. 'PBKDF2$iterations$salt$hashed_string'
     """
-    salt_length = config.parser.getint('security', 'salt_length')
-    iterations = config.parser.getint('security', 'iterations')
-    key_length = config.parser.getint('security', 'key_length')
-    salt = hexlify_(os.urandom(salt_length))
-    hashed_string = pbkdf2_hex(string_to_hash, salt, iterations=iterations,
-                               keylen=key_length)
-    return '$'.join(['PBKDF2-256', str(iterations), salt, hashed_string])
+    algorithm = settings.security.algorithm
+    iterations = settings.security.iterations
+    salt = hexlify_(os.urandom(settings.security.salt_length))
+    hashed_string = hashers[algorithm](string_to_hash, salt, iterations,
+                                       settings.security.key_length)
+    return '$'.join([algorithm, str(iterations), salt, hashed_string])
 
 
 def compare_hash(plain_string, old_hash):
-    """ Compares an hash generated with plain_string to an exisiting hash."""
-    key_length = config.parser.getint('security', 'key_length')
+    """ Compares an hash generated with plain_string to an exisiting hash.
+    The algorithm, iterations and key length are the ones of the existing
+    hash."""
     splitted = old_hash.split('$')
+    if splitted[0] not in hashers:
+        return False
     iterations = int(splitted[1])
     salt = splitted[2]
-    new_hash = pbkdf2_hex(plain_string, salt, iterations=iterations,
-                          keylen=key_length)
+    key_length = len(splitted[3]) // 2
+    new_hash = hashers[splitted[0]](plain_string, salt, iterations,
+                                    key_length)
     return safe_str_cmp(new_hash, splitted[3])
+
+
+def needs_rehash(old_hash):
+    """ Tells whether an hash was generated with a different algorithm or
+    with less iterations than the configured ones."""
+    splitted = old_hash.split('$')
+    if splitted[0] != settings.security.algorithm:
+        return True
+    return int(splitted[1]) < settings.security.iterations
+
+
+class HashingPoolFull(Exception):
+    """
+    Raised when the hashing pool can not accept more jobs.
+    """
+    pass
+
+
+class HashingPool(object):
+    """
+    Runs hashing functions in a pool of threads or processes. At most
+    workers + queue jobs can be pending at the same time; further jobs are
+    refused immediately with HashingPoolFull.
+    """
+    def __init__(self, executor='thread', workers=4, queue=16):
+        self.slots = BoundedSemaphore(workers + queue)
+        if executor == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def run(self, function, *args):
+        """
+        Runs function in the pool and waits for its result.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise HashingPoolFull()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+
+hashing_pool = HashingPool(
+    executor=settings.hashing.executor,
+    workers=settings.hashing.workers,
+    queue=settings.hashing.queue
+)
@@ -18,13 +18,22 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
-from peewee import (BooleanField, CharField, DateTimeField, FloatField,
-                    ForeignKeyField, IntegerField, PrimaryKeyField, TextField)
-from playhouse.signals import Model, post_delete, pre_delete, pre_save
+import re
+from peewee import (BigIntegerField, BooleanField, CharField, DateTimeField,
+                    FloatField, ForeignKeyField, IntegerField,
+                    PrimaryKeyField, TextField)
+from playhouse.migrate import PostgresqlMigrator, migrate
+from playhouse.signals import (Model, post_delete, post_save, pre_delete,
+                               pre_save)
 
 
-from .Base import db
-from .Crypto import generate_hash, hexlify_
+from .Base import db, settings
+from .Cache import Cache
+from .Crypto import generate_hash, hashing_pool, hexlify_
+
+
+permissions_cache = Cache(settings.cache.permissions,
+                          ttl=settings.cache.permissions_ttl or None)
 
 
 class Base(Model):
@@ -46,57 +55,118 @@ class Users(Base):
     enabled = BooleanField()
     last_login = DateTimeField(null=True)
 
+    def rules(self, rules, action, model_name, item_id):
+        """
+        Builds the query that finds the rule deciding whether the user can
+        perform action on an item. Only the first rule returned is decisive.
+        """
+        return rules.select()\
+            .where((rules.user == self.id) | (rules.rank == self.rank))\
+            .where(rules.model == model_name)\
+            .where((rules.item == None) | (rules.item == item_id))\
+            .where(getattr(rules, action) != None)\
+            .order_by(rules.level.desc(), rules.item.asc(), rules.rank.desc())\
+            .limit(1)
+
     def can(self, requested_action, item):
         if self.rank == 10:
             return True
+        model_name = getattr(item._meta, 'db_table')
+        key = (self.id, self.rank, model_name, item.id, requested_action)
+        decision = permissions_cache.get(key)
+        if decision is None:
+            decision = self.evaluate(requested_action, model_name, item.id)
+            permissions_cache.set(key, decision)
+        return decision
+
+    def evaluate(self, requested_action, model_name, item_id):
+        """
+        Evaluates the rules for an item, without using the permissions cache.
+        """
+        if requested_action == 'create':
+            action = 'read'
         else:
+            action = requested_action
+        rules = self.rules(AccessRules, action, model_name, item_id)
+        if len(rules) > 0:
             if requested_action == 'create':
-                action = 'read'
+                if getattr(rules[0], action) >= 5:
+                    return True
+                else:
+                    return False
             else:
-                action = requested_action
-            model_name = getattr(item._meta, 'db_table')
-            rules = AccessRules.select()\
-                .where((AccessRules.user == self.id) |
-                       (AccessRules.rank == self.rank))\
-                .where(AccessRules.model == model_name)\
-                .where((AccessRules.item == None) |
-                       (AccessRules.item == item.id))\
-                .where(getattr(AccessRules, action) != None)\
-                .order_by(AccessRules.level.desc(), AccessRules.item.asc(),
-                          AccessRules.rank.desc())\
-                .limit(1)
-            if len(rules) > 0:
-                if requested_action == 'create':
-                    if getattr(rules[0], action) >= 5:
-                        return True
-                    else:
-                        return False
+                if getattr(rules[0], action) >= 1:
+                    return True
                 else:
-                    if getattr(rules[0], action) >= 1:
-                        return True
-                    else:
-                        return False
-            return False
+                    return False
+        return False
+
+    def filter_query(self, requested_action, model, query):
+        """
+        Restricts a query on model to the items on which the user can perform
+        requested_action. The rules evaluated by can are compiled in a
+        correlated subquery, so that the whole query is still a single one.
+        """
+        if self.rank == 10:
+            return query
+        if requested_action == 'create':
+            action = 'read'
+            minimum = 5
+        else:
+            action = requested_action
+            minimum = 1
+        model_name = getattr(model._meta, 'db_table')
+        rules = AccessRules.alias()
+        decisive_rule = self.rules(rules, action, model_name, model.id)\
+            .select(getattr(rules, action))
+        return query.where(decisive_rule >= minimum)
 
 
 @pre_save(sender=Users)
 def on_user_save(model_class, instance, created):
     """
-    Hashes the password.
+    Hashes the password, using the hashing pool.
     """
     dirty = getattr(instance, '_dirty')
     if 'password' in dirty:
-        instance.password = generate_hash(instance.password)
+        instance.password = hashing_pool.run(generate_hash, instance.password)
+
+
+@post_save(sender=Users)
+def on_user_post_save(model_class, instance, created):
+    """
+    Removes the cached permissions of an user when it's changed.
+    """
+    permissions_cache.invalidate(lambda key, value: key[0] == instance.id)
+
+
+@post_delete(sender=Users)
+def on_user_delete(model_class, instance):
+    """
+    Removes the cached permissions of a deleted user.
+    """
+    permissions_cache.invalidate(lambda key, value: key[0] == instance.id)
 
 
 class Types(Base):
     """
     The Types specify the custom types that should be generated. Only enabled
     types will be generated.
+
+    The count_mode tells how collections of the type are counted: exact,
+    estimate or none. When null, collections.count is used.
+
+    max_items limits the page size of the collections of the type, replacing
+    collections.max_items. filterable and sortable are the comma separated
+    columns that can be queried and ordered; when null, any column can.
     """
     id = PrimaryKeyField(primary_key=True)
     name = CharField(unique=True)
     enabled = BooleanField()
+    count_mode = CharField(null=True)
+    max_items = IntegerField(null=True)
+    filterable = CharField(null=True)
+    sortable = CharField(null=True)
 
 
 @post_delete(sender=Types)
@@ -129,6 +199,9 @@ class Fields(Base):
     type: the type to which the field belongs
     unique: whether the generated column should be unique
     nullable: whether the generated column should have be nullable
+    indexed: whether the generated column should be indexed
+    searchable: whether the generated column, when a string, should be
+    included in the full-text search of the type
     label: a label for the column, for informative purposes
     description: a description for the column, for infformative purposes
     """
@@ -138,10 +211,52 @@ class Fields(Base):
     field_type = CharField()
     unique = BooleanField(null=True)
     nullable = BooleanField(null=True)
+    indexed = BooleanField(null=True)
+    searchable = BooleanField(null=True)
     label = CharField(null=True)
     description = CharField(null=True)
 
 
+class Indexes(Base):
+    """
+    The indexes on more than one column of the custom types. They are
+    created when the type is generated.
+
+    name: the name of the index, unique for its type
+    type: the type to which the index belongs
+    columns: the comma separated fields of the type to index, each
+    optionally followed by ASC or DESC
+    unique: whether the index should be unique
+    """
+    id = PrimaryKeyField(primary_key=True)
+    name = CharField()
+    type = ForeignKeyField(Types)
+    columns = CharField()
+    unique = BooleanField(null=True)
+
+
+@pre_save(sender=Indexes)
+def on_index_save(model_class, instance, created):
+    """
+    Checks that the name of an index is an identifier and that its columns
+    are fields of its type.
+    """
+    check_index_name(instance.name)
+    query = Fields.select().where(Fields.type == instance.type)
+    names = set(['id', 'owner'] + [field.name for field in query])
+    parse_index_columns(names, instance.columns)
+
+
+@post_delete(sender=Indexes)
+def on_index_delete(model_class, instance):
+    """
+    Drops the index from the table of its type.
+    """
+    name = index_name(type_table(instance.type), instance.name)
+    execute_concurrently('DROP INDEX',
+                         'IF EXISTS {}'.format(db.compiler().quote(name)))
+
+
 class AccessRules(Base):
     """
     AccessRules define the permissions that an users or a group of users have
@@ -158,6 +273,22 @@ class AccessRules(Base):
     eliminate = IntegerField(null=True)
 
 
+@post_save(sender=AccessRules)
+def on_rule_save(model_class, instance, created):
+    """
+    Clears the permissions cache whenever a rule is created or changed.
+    """
+    permissions_cache.clear()
+
+
+@post_delete(sender=AccessRules)
+def on_rule_delete(model_class, instance):
+    """
+    Clears the permissions cache whenever a rule is deleted.
+    """
+    permissions_cache.clear()
+
+
 class EternalTokens(Base):
     """
     EternalTokens are server-stored tokens used for authentication purposes.
@@ -169,18 +300,275 @@ class EternalTokens(Base):
     id = PrimaryKeyField(primary_key=True)
     name = CharField()
     user = ForeignKeyField(Users)
-    token = CharField()
+    token = CharField(unique=True)
+    generation = IntegerField(default=0)
 
 
 @pre_save(sender=EternalTokens)
 def on_token_save(model_class, instance, created):
     """
     Peewee hook that generates a random token whenever an eternal token is
-    created.
+    created. When the token of an existing eternal token is regenerated or
+    it's given to another user, its generation is increased and the previous
+    one is revoked, so that the stateless tokens issued before are refused.
     """
     dirty = getattr(instance, '_dirty')
     if 'token' in dirty:
         instance.token = hexlify_(os.urandom(24))
+    if not created and ('token' in dirty or 'user' in dirty):
+        previous = EternalTokens.get(EternalTokens.id == instance.id)
+        if 'token' in dirty or previous.user_id != instance.user_id:
+            RevokedTokens.create(token=instance.id, user=previous.user_id,
+                                 generation=previous.generation)
+            instance.generation = previous.generation + 1
+
+
+@post_delete(sender=EternalTokens)
+def on_token_revoke(model_class, instance):
+    """
+    Records the deletion of an eternal token, so that the stateless tokens
+    issued for it are refused.
+    """
+    RevokedTokens.create(token=instance.id, user=instance.user_id,
+                         generation=instance.generation)
+
+
+class RevokedTokens(Base):
+    """
+    RevokedTokens keep track of the deleted, regenerated and reassigned
+    eternal tokens. Stateless tokens carry the id and the generation of their
+    eternal token and are refused if that generation, or a later one, is
+    here.
+    """
+    id = PrimaryKeyField(primary_key=True)
+    token = IntegerField(index=True)
+    user = IntegerField()
+    generation = IntegerField(default=0)
+
+    class Meta:
+        versioned = False
+
+
+class TableVersions(Base):
+    """
+    TableVersions hold a counter for each table, increased whenever one of
+    its rows is written, and the time of the last write in UTC. They are
+    cheap to read and let clients revalidate their copies with conditional
+    requests. Tables that are not served, like this one, set the versioned
+    option to False.
+    """
+    name = CharField(primary_key=True)
+    version = BigIntegerField(default=0)
+    modified = DateTimeField(null=True)
+
+    class Meta:
+        versioned = False
+
+    @classmethod
+    def bump(cls, table):
+        """
+        Increases the version of a table. The upsert runs in the same
+        transaction as the write.
+        """
+        db.execute_sql(('INSERT INTO tableversions (name, version, modified) '
+                        "VALUES (%s, 1, timezone('utc', now())) "
+                        'ON CONFLICT (name) DO UPDATE SET '
+                        'version = tableversions.version + 1, '
+                        'modified = EXCLUDED.modified'), (table, ))
+
+    @classmethod
+    def read(cls, tables):
+        """
+        Returns a dictionary of the (version, modified) pairs of tables.
+        Tables that were never written are missing from it.
+        """
+        query = cls.select(cls.name, cls.version, cls.modified)\
+            .where(cls.name << list(tables)).tuples()
+        return {name: (version, modified) for name, version, modified in query}
+
+
+@post_save()
+def on_version_save(model_class, instance, created):
+    if getattr(model_class._meta, 'versioned', True):
+        TableVersions.bump(instance._meta.db_table)
+
+
+@post_delete()
+def on_version_delete(model_class, instance):
+    on_version_save(model_class, instance, False)
+
+
+def upgrade_tables():
+    """
+    Brings databases created with efesto 0.7 or earlier up to date, creating
+    the tables, the columns of types, fields and tokens and the unique index
+    on the eternal tokens that they lack. Existing tables, columns and indexes
+    are left as they are.
+    """
+    db.create_tables([Indexes, RevokedTokens, TableVersions], safe=True)
+    migrator = PostgresqlMigrator(db)
+    operations = []
+    for model in [Types, Fields, EternalTokens, RevokedTokens]:
+        table = model._meta.db_table
+        columns = [column.name for column in db.get_columns(table)]
+        for field in model._meta.sorted_fields:
+            if field.db_column not in columns:
+                operations.append(migrator.add_column(table, field.db_column,
+                                                      field))
+    with db.atomic():
+        migrate(*operations)
+    compiler = db.compiler()
+    table = EternalTokens._meta.db_table
+    column = EternalTokens.token.db_column
+    index = compiler.index_name(table, [column])
+    execute_concurrently('CREATE UNIQUE INDEX', 'IF NOT EXISTS {} ON {} ({})'
+                         .format(compiler.quote(index), compiler.quote(table),
+                                 compiler.quote(column)))
+
+
+def type_table(custom_type):
+    """
+    Returns the table of the model generated for a type, named the way
+    peewee names the tables of models.
+    """
+    return re.sub(r'[^\w]+', '_', custom_type.name.lower())
+
+
+def index_name(table, name):
+    return '{}_{}'.format(table, name)
+
+
+def check_index_name(name):
+    """
+    Raises a ValueError unless the name of an index is a plain identifier,
+    since it ends up in the index statements.
+    """
+    if not re.match(r'[A-Za-z_][A-Za-z0-9_]*\Z', name or ''):
+        raise ValueError('Invalid index name: %s' % (name))
+
+
+def parse_index_columns(names, columns):
+    """
+    Parses the comma separated columns of an index, returning a list of
+    (name, direction) tuples. Since the columns end up in the index
+    definition, anything but one of the given names, optionally followed by
+    ASC or DESC, raises a ValueError.
+    """
+    parsed = []
+    for column in columns.split(','):
+        words = column.split()
+        direction = ''
+        if len(words) == 2 and words[1].upper() in ('ASC', 'DESC'):
+            direction = words[1].upper()
+            words = words[:1]
+        if len(words) != 1 or words[0] not in names:
+            raise ValueError('Invalid index column: %s' % (column.strip()))
+        parsed.append((words[0], direction))
+    return parsed
+
+
+def execute_concurrently(statement, definition):
+    """
+    Runs an index statement CONCURRENTLY, so that it doesn't block writes on
+    the table. Concurrent statements can't run in a transaction, so inside
+    one the statement runs as a plain one.
+    """
+    if db.transaction_depth() > 0:
+        db.execute_sql('{} {}'.format(statement, definition))
+        return
+    connection = db.get_conn()
+    connection.commit()
+    connection.autocommit = True
+    try:
+        sql = '{} CONCURRENTLY {}'.format(statement, definition)
+        connection.cursor().execute(sql)
+    finally:
+        connection.autocommit = False
+
+
+def create_indexes(model, custom_type, columns):
+    """
+    Creates the indexes of a generated model: one for each indexed field and
+    the composite indexes of its type. Existing indexes are left as they
+    are.
+    """
+    table = model._meta.db_table
+    compiler = db.compiler()
+    indexes = []
+    for column in columns:
+        if column.indexed:
+            db_column = model._meta.fields[column.name].db_column
+            indexes.append((compiler.index_name(table, [db_column]),
+                            compiler.quote(db_column), column.unique))
+    query = Indexes.select().where(Indexes.type == custom_type.id)
+    for index in query:
+        check_index_name(index.name)
+        definition = []
+        for name, direction in parse_index_columns(model._meta.fields,
+                                                   index.columns):
+            db_column = compiler.quote(model._meta.fields[name].db_column)
+            definition.append(' '.join(filter(None, [db_column, direction])))
+        indexes.append((index_name(table, index.name), ', '.join(definition),
+                        index.unique))
+    for name, definition, unique in indexes:
+        statement = 'CREATE UNIQUE INDEX' if unique else 'CREATE INDEX'
+        definition = 'IF NOT EXISTS {} ON {} ({})'.format(
+            compiler.quote(name), compiler.quote(table), definition)
+        execute_concurrently(statement, definition)
+
+
+def quote_literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def create_search(model, searchable, batch=1000):
+    """
+    Maintains the _search tsvector column of a generated model, computed by
+    a trigger from its searchable columns and indexed with GIN.
+
+    Processes starting together take an advisory lock on the table, so that
+    only one of them adds the column. The process that adds it then fills it
+    in for the existing rows, in batches of their own transactions, so that
+    writes are not blocked for the whole table. The trigger skips updates
+    that don't change the searchable columns, so the backfill computes the
+    column like the trigger does.
+    """
+    compiler = db.compiler()
+    language = 'pg_catalog.{}'.format(settings.collections.search_language)
+    arguments = [quote_literal(language)]
+    vectors = []
+    for name in searchable:
+        column = model._meta.fields[name].db_column
+        arguments.append(quote_literal(column))
+        vectors.append("to_tsvector({}, coalesce({}, ''))".format(
+            quote_literal(language), compiler.quote(column)))
+    table = compiler.quote(model._meta.db_table)
+    trigger = ('CREATE TRIGGER "_search" BEFORE INSERT OR UPDATE ON {} '
+               'FOR EACH ROW EXECUTE PROCEDURE '
+               'tsvector_update_trigger(_search, {})')
+    with db.atomic():
+        db.execute_sql('SELECT pg_advisory_xact_lock(hashtext(%s))',
+                       (model._meta.db_table, ))
+        added = '_search' not in [i.name for i in db.get_columns(
+            model._meta.db_table)]
+        db.execute_sql('DROP TRIGGER IF EXISTS "_search" ON {}'.format(table))
+        if added:
+            db.execute_sql('ALTER TABLE {} ADD COLUMN _search tsvector'.format(
+                table))
+        db.execute_sql(trigger.format(table, ', '.join(arguments)))
+    if added:
+        cursor = db.execute_sql('SELECT min(id), max(id) FROM {}'.format(
+            table))
+        first, last = cursor.fetchone()
+        update = 'UPDATE {} SET _search = {} WHERE id >= %s AND id < %s'\
+            .format(table, ' || '.join(vectors))
+        while first is not None and first <= last:
+            with db.atomic():
+                db.execute_sql(update, (first, first + batch))
+            first += batch
+    index = compiler.quote(index_name(model._meta.db_table, '_search'))
+    execute_concurrently('CREATE INDEX', 'IF NOT EXISTS {} ON {} USING gin '
+                         '(_search)'.format(index, table))
 
 
 def make_field(type, column):
@@ -196,6 +584,8 @@ def make_field(type, column):
             args_dict['null'] = True
         if column.unique:
             args_dict['unique'] = True
+        if column.indexed:
+            args_dict['index'] = True
         return default_fields[column.field_type](**args_dict)
     parent_type = Types.get(Types.name == column.field_type)
     if parent_type.id != type.id:
@@ -213,9 +603,21 @@ def make_model(custom_type):
         attributes = {}
         attributes['owner'] = ForeignKeyField(Users)
         columns = Fields.select().where(Fields.type == custom_type.id)
+        searchable = []
         for column in columns:
             attributes[column.name] = make_field(custom_type, column)
+            if column.searchable and column.field_type == 'string':
+                searchable.append(column.name)
+        attributes['Meta'] = type('Meta', (object, ),
+                                  {'count_mode': custom_type.count_mode,
+                                   'max_items': custom_type.max_items,
+                                   'filterable': custom_type.filterable,
+                                   'sortable': custom_type.sortable,
+                                   'searchable': len(searchable) > 0})
         model = type('%s' % (custom_type.name), (Base, ), attributes)
         db.create_tables([model], safe=True)
+        create_indexes(model, custom_type, columns)
+        if searchable:
+            create_search(model, searchable)
         return model
     raise ValueError('Cannot generate a model for a disabled type')
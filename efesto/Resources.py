@@ -17,17 +17,33 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import json
-from datetime import datetime
+import base64
+import binascii
+import hashlib
+from contextlib import contextmanager
+from itertools import chain
 import falcon
 
 
-from peewee import FieldDescriptor, ObjectIdDescriptor, RelationDescriptor
+from peewee import (CharField, FieldDescriptor, ForeignKeyField,
+                    ObjectIdDescriptor, RelationDescriptor, SQL, TextField)
+from playhouse.postgres_ext import ServerSide
+from playhouse.signals import post_delete, post_save
+from psycopg2.extensions import QueryCanceledError
 from .Auth import (authenticate_by_password, authenticate_by_token,
-                   generate_token)
-from .Base import config, db
-from .Models import EternalTokens
-from .Siren import hinder
+                   generate_token, principals_cache, tokens_cache,
+                   users_cache)
+from .Base import db, settings
+from .Cache import Cache
+from .Codec import dumps, loads
+from .Crypto import HashingPoolFull
+from .Models import (AccessRules, EternalTokens, TableVersions,
+                     permissions_cache)
+from .Siren import hinder, hinder_stream, page_links
+
+
+responses_cache = Cache(settings.cache.responses,
+                        ttl=settings.cache.responses_ttl or None)
 
 
 def model_columns(model):
@@ -62,46 +78,480 @@ def build_fields(params):
     return ['id']
 
 
-def build_query(model, params):
-    query = model.select()
+def positive_argument(params, name):
+    """
+    Reads a page argument, refusing anything but a positive integer.
+    """
+    try:
+        value = int(params[name])
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise falcon.HTTPBadRequest('Bad request', 'The {} argument must be \
+a positive integer'.format(name))
+    return value
+
+
+def build_pagination(params):
+    """
+    Reads the page, items and order_by arguments. Batch fetches by a list of
+    ids get all their items in one page, unless items is given.
+    """
+    page = 1
+    if 'page' in params:
+        page = positive_argument(params, 'page')
+
+    items = 20
+    if 'items' in params:
+        items = positive_argument(params, 'items')
+    elif isinstance(params.get('id'), list):
+        items = len(params['id'])
+
+    order = None
+    if 'order_by' in params:
+        order = params['order_by']
+    return page, items, order
+
+
+def check_items(model, items):
+    """
+    Refuses pages larger than the max_items of a type or, for types without
+    one, than the collections.max_items option.
+    """
+    max_items = getattr(model._meta, 'max_items', None)
+    if not max_items:
+        max_items = settings.collections.max_items
+    if 0 < max_items < items:
+        raise falcon.HTTPBadRequest('Bad request', 'The items argument can \
+be at most {}'.format(max_items))
+
+
+def check_columns(model, option, columns):
+    """
+    Refuses the columns that a type doesn't list in its filterable or
+    sortable option. Types without the option allow every column, and the
+    id is always allowed.
+    """
+    allowed = getattr(model._meta, option, None)
+    if allowed is None:
+        return
+    allowed = [i.strip() for i in allowed.split(',')] + ['id']
+    for column in columns:
+        if column not in allowed:
+            raise falcon.HTTPBadRequest('Bad request', 'The column {} is not \
+{}'.format(column, option))
+
+
+def build_count_mode(model, params):
+    """
+    Reads the count argument, falling back to the type's count mode and then
+    to the configured one.
+    """
+    if 'count' in params:
+        if params['count'] not in ['exact', 'estimate', 'none']:
+            raise falcon.HTTPBadRequest('Bad request', 'The count argument \
+must be exact, estimate or none')
+        return params['count']
+    count_mode = getattr(model._meta, 'count_mode', None)
+    if count_mode in ['exact', 'estimate', 'none']:
+        return count_mode
+    return settings.collections.count
+
+
+def estimate_count(query):
+    """
+    Estimates the number of rows of a query from the planner statistics,
+    without running it.
+    """
+    sql, params = query.sql()
+    cursor = db.execute_sql('EXPLAIN (FORMAT JSON) %s' % (sql), params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginate_by_page(query, page, items, count_mode):
+    """
+    Paginates a query by page number. Returns the rows, the count (None when
+    not counting) and whether there are further pages. Without an exact
+    count, one more row is fetched to know whether a next page exists.
+    """
+    if count_mode == 'exact':
+        count = query.count()
+        return query.paginate(page, items), count, count > page * items
+    count = None
+    if count_mode == 'estimate':
+        count = estimate_count(query)
+    rows = list(query.limit(items + 1).offset((page - 1) * items))
+    return rows[:items], count, len(rows) > items
+
+
+def build_projection(descriptor, fields, embeds):
+    """
+    Builds the list of columns to select for the requested fields and the
+    foreign keys of the embeds. An empty list selects every column.
+    """
+    if fields == 'all':
+        return []
+    projection = []
+    names = []
+    for name in fields + embeds:
+        field = descriptor.field(name)
+        if field is not None and field.name not in names:
+            projection.append(field)
+            names.append(field.name)
+    return projection
+
+
+def escape_like(value):
+    """
+    Escapes the wildcards of a LIKE pattern.
+    """
+    for char in ['\\', '%', '_']:
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def build_filter(field, argument):
+    """
+    Builds the predicate of a query argument. Lists become IN, closed a..b
+    ranges BETWEEN and, on text fields, values ending in * prefix matches,
+    so that they can all be served by an index on the column.
+    """
+    if isinstance(argument, list):
+        return field << argument
+    if argument[0] == '<':
+        return field <= argument[1:]
+    elif argument[0] == '>':
+        return field >= argument[1:]
+    elif argument[0] == '!':
+        return field != argument[1:]
+    elif argument[0] == '-':
+        return field >> None
+    low, dots, high = argument.partition('..')
+    if low and high:
+        return field.between(low, high)
+    if argument[-1] == '*' and isinstance(field, (CharField, TextField)):
+        return field % (escape_like(argument[:-1]) + '%')
+    return field == argument
+
+
+def build_search(model, query, search, ranked):
+    """
+    Restricts a query to the items matching a full-text search, with the GIN
+    index on the search column of the type. When ranked, the best matches
+    come first.
+    """
+    if not getattr(model._meta, 'searchable', False):
+        raise falcon.HTTPBadRequest('Bad request', 'The type has no \
+searchable fields')
+    if isinstance(search, list):
+        search = ' '.join(search)
+    language = settings.collections.search_language
+    tsquery = 'plainto_tsquery(%s::regconfig, %s)'
+    query = query.where(SQL('_search @@ ' + tsquery, language, search))
+    if ranked:
+        rank = SQL('ts_rank(_search, {}) DESC'.format(tsquery), language,
+                   search)
+        query = query.order_by(rank, model.id)
+    return query
+
+
+def build_query(model, params, projection=()):
+    query = model.select(*projection)
     for key, argument in params.items():
-        if argument[0] == '<':
-            query = query.where(getattr(model, key) <= argument[1:])
-        elif argument[0] == '>':
-            query = query.where(getattr(model, key) >= argument[1:])
-        elif argument[0] == '!':
-            query = query.where(getattr(model, key) != argument[1:])
-        elif argument[0] == '-':
-            query = query.where(getattr(model, key) >> None)
-        else:
-            query = query.where(getattr(model, key) == argument)
+        query = query.where(build_filter(model_field(model, key), argument))
     return query
 
 
-def build_item(columns, fields, currrent_item, embeds):
-    item = {}
-    for column in columns:
-        if column in fields or fields == 'all':
-            item[column] = getattr(currrent_item, column)
+def load_embeds(user, descriptor, serializer, rows, embeds):
+    """
+    Loads the items embedded in a page with one query per embed, instead of
+    one per row. Returns the data of the items by embed and id; the items
+    that user can not read are left out.
+    """
+    embedded = {}
     for embed in embeds:
-        column_to_embed = getattr(currrent_item, embed)
-        item[embed] = getattr(column_to_embed, '_data')
+        field = descriptor.foreign_keys.get(embed)
+        if field is None:
+            continue
+        position = serializer.index[field.name]
+        ids = set([row[position] for row in rows])
+        ids.discard(None)
+        embedded[field.name] = {}
+        if len(ids) > 0:
+            related = field.rel_model
+            query = related.select().where(related.id << list(ids))
+            query = user.filter_query('read', related, query)
+            for related_item in query:
+                embedded[field.name][related_item.id] = related_item._data
+    return embedded
+
+
+def build_item(serializer, row, embedded):
+    item = serializer.serialize(row)
+    for embed in embedded:
+        item[embed] = embedded[embed].get(row[serializer.index[embed]])
     return item
 
 
 def build_order(model, query, order):
-    if order[0] == '<':
-        query = query.order_by(getattr(model, order[1:]).desc())
-    elif order[0] == '>':
-        query = query.order_by(getattr(model, order[1:]).asc())
-    else:
-        query = query.order_by(getattr(model, order).asc())
-    return query
+    """
+    Orders a query by the columns of an order_by argument and the id.
+    """
+    fields = []
+    orders = parse_order(order)
+    check_columns(model, 'sortable', [i[0] for i in orders])
+    for column, descending in orders:
+        field = model_field(model, column)
+        if field is None:
+            raise falcon.HTTPBadRequest('Bad request', 'The order column is \
+not valid')
+        fields.append(field.desc() if descending else field.asc())
+    return query.order_by(*fields)
+
+
+def parse_order(order):
+    """
+    Parses an order_by argument, a column or a list of columns prefixed by
+    their direction. Returns the (column, descending) pairs, ending with the
+    id as tie-breaker, in the direction of the column before it.
+    """
+    if isinstance(order, str):
+        order = [order]
+    orders = []
+    for i in order:
+        if i == '':
+            continue
+        if i[0] == '<':
+            orders.append((i[1:], True))
+        elif i[0] == '>':
+            orders.append((i[1:], False))
+        else:
+            orders.append((i, False))
+        if orders[-1][0] == 'id':
+            return orders
+    descending = orders[-1][1] if orders else False
+    orders.append(('id', descending))
+    return orders
+
+
+def model_field(model, column):
+    """
+    Finds the field of a column, including foreign keys columns like owner_id.
+    """
+    for field in model._meta.fields.values():
+        if field.name == column or field.db_column == column:
+            return field
+    return None
+
+
+class RowSerializer(object):
+    """
+    Turns the tuples read by a query into item dictionaries. It's built once
+    for each selection and requested fields, and the index gives the
+    position of each selected field in the tuples.
+    """
+    def __init__(self, names, keys):
+        self.index = {name: position for position, name in enumerate(names)}
+        pairs = sorted([(self.index[key], column) for column, key in keys
+                        if key in self.index])
+        columns = [column for position, column in pairs]
+        positions = [position for position, column in pairs]
+
+        if positions == list(range(len(names))):
+            def serialize(row):
+                return dict(zip(columns, row))
+        else:
+            def serialize(row):
+                return {column: row[position] for position, column in pairs}
+        self.serialize = serialize
+
+
+class ModelDescriptor(object):
+    """
+    Describes the columns of a model, so that request handlers don't need to
+    inspect it on every request. It's created once for each generated
+    collection and resource.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.columns = model_columns(model)
+        self.fields = {}
+        for column in self.columns:
+            self.fields[column] = model_field(model, column)
+        self.foreign_keys = {}
+        for field in model._meta.fields.values():
+            if isinstance(field, ForeignKeyField):
+                self.foreign_keys[field.name] = field
+        self.keys = [(column, self.fields[column].name)
+                     for column in self.columns]
+        self.serializers = {}
+
+    def field(self, name):
+        """
+        Finds the field of a column or of a foreign key, like owner_id or
+        owner.
+        """
+        if name in self.fields:
+            return self.fields[name]
+        return self.foreign_keys.get(name)
+
+    def data_keys(self, fields):
+        """
+        Returns the columns to output for the requested fields, paired with
+        their key in the items data.
+        """
+        if fields == 'all':
+            return self.keys
+        return [(column, key) for column, key in self.keys if column in fields]
+
+    def row_serializer(self, query, fields):
+        """
+        Returns the serializer for the tuples read by a query, building it
+        the first time a selection and fields are requested. Fields are
+        reduced to the model's columns first, so that unknown ones can't
+        grow the serializers.
+        """
+        names = tuple([getattr(i, 'name', None) for i in query._select])
+        keys = tuple(self.data_keys(fields))
+        if (names, keys) not in self.serializers:
+            self.serializers[(names, keys)] = RowSerializer(names, keys)
+        return self.serializers[(names, keys)]
+
+    def to_dictionary(self, item, fields='all'):
+        data = item._data
+        return {column: data.get(key)
+                for column, key in self.data_keys(fields)}
+
+
+def encode_cursor(orders, values, backwards=False):
+    """
+    Builds an opaque cursor that points after the item with the given values
+    of the order columns or, when backwards is true, before it.
+    """
+    cursor = [orders, values, backwards]
+    return base64.urlsafe_b64encode(dumps(cursor)).decode('UTF-8')
+
+
+def decode_cursor(descriptor, cursor):
+    try:
+        decoded = base64.urlsafe_b64decode(cursor.encode('UTF-8'))
+        orders, values, backwards = loads(decoded)
+        orders = [(column, bool(descending)) for column, descending in orders]
+    except (binascii.Error, TypeError, ValueError):
+        raise falcon.HTTPBadRequest('Bad request', 'The cursor is not valid')
+    columns = [i[0] for i in orders]
+    valid = len(values) == len(orders) and columns[-1:] == ['id']
+    if not valid or not set(columns).issubset(descriptor.fields):
+        raise falcon.HTTPBadRequest('Bad request', 'The cursor is not valid')
+    return orders, values, backwards
+
+
+def keyset_predicate(fields, values, backwards):
+    """
+    Selects the rows that come after the given values of the order fields
+    or, when backwards is true, before them. Every field is compared only
+    when the fields before it are equal; nulls are sorted as the largest
+    values, like Postgres does.
+    """
+    predicate = None
+    equal = None
+    for (field, descending), value in zip(fields, values):
+        if descending == backwards:
+            after = None
+            if value is not None:
+                after = (field > value) | (field >> None)
+        elif value is None:
+            after = field.is_null(False)
+        else:
+            after = field < value
+        if after is not None:
+            if equal is not None:
+                after = equal & after
+            predicate = after if predicate is None else predicate | after
+        same = field >> None if value is None else field == value
+        equal = same if equal is None else equal & same
+    return predicate
+
 
+def paginate_by_cursor(descriptor, query, cursor, order, items):
+    """
+    Paginates a query with a keyset on the order columns and id, so that
+    every page costs the same regardless of its depth. Returns the rows, the
+    cursors of the previous and next pages and the query, whose selection
+    includes the order columns.
+    """
+    backwards = False
+    if cursor == 'start':
+        orders = parse_order(order or 'id')
+        if not set([i[0] for i in orders]).issubset(descriptor.fields):
+            raise falcon.HTTPBadRequest('Bad request', 'The order column is \
+not valid')
+    else:
+        orders, values, backwards = decode_cursor(descriptor, cursor)
+    check_columns(descriptor.model, 'sortable', [i[0] for i in orders])
+    fields = [(descriptor.fields[column], descending)
+              for column, descending in orders]
+    selected = [getattr(i, 'name', None) for i in query._select]
+    missing = [i[0] for i in fields if i[0].name not in selected]
+    if missing:
+        query = query.select(*(query._select + missing))
+        selected += [i.name for i in missing]
+    positions = [selected.index(i[0].name) for i in fields]
+    if cursor != 'start':
+        query = query.where(keyset_predicate(fields, values, backwards))
+    query = query.order_by(*[field.desc() if descending != backwards
+                             else field.asc() for field, descending in fields])
+    rows = list(query.limit(items + 1))
+    more = len(rows) > items
+    rows = rows[:items]
+    if backwards:
+        rows.reverse()
+
+    cursors = {}
+    if rows:
+        if more or backwards:
+            last = rows[-1]
+            cursors['next'] = encode_cursor(orders,
+                                            [last[i] for i in positions])
+        if cursor != 'start' and (more or not backwards):
+            first = rows[0]
+            cursors['previous'] = encode_cursor(orders,
+                                                [first[i] for i in positions],
+                                                backwards=True)
+    return rows, cursors, query
+
+
+def build_link_headers(request, response, count, items, page, cursors=None,
+                       more=None):
+    """
+    Adds the pagination Link headers. When the count is not exact, more
+    tells whether there is a next page and the last page is given only if
+    an estimated count is available.
+    """
+    if cursors is not None:
+        domain = '{}://{}?cursor=%s&items={}'.format(request.protocol,
+                                                     request.host, items)
+        if 'previous' in cursors:
+            response.add_link(domain % (cursors['previous']), rel='prev')
+        if 'next' in cursors:
+            response.add_link(domain % (cursors['next']), rel='next')
+        return
 
-def build_link_headers(request, response, count, items, page):
     domain = '{}://{}?page=%s&items={}'.format(request.protocol,
                                                request.host, items)
+    if more is not None:
+        if page != 1:
+            response.add_link(domain % (page - 1), rel='prev')
+        if count is not None:
+            last = max(int(count / items) + 1, page)
+            response.add_link(domain % (last), rel='last')
+        if more:
+            response.add_link(domain % (page + 1), rel='next')
+        return
+
     last_page = int(count / items)
 
     if page != 1:
@@ -118,15 +568,12 @@ def build_link_headers(request, response, count, items, page):
             response.add_link(next_url, rel='next')
 
 
-def item_to_dictionary(model, item):
-    item_dict = {}
-    for k in model.__dict__:
-        if isinstance(model.__dict__[k], FieldDescriptor):
-            if not isinstance(model.__dict__[k], RelationDescriptor):
-                item_dict[k] = getattr(item, k)
-        if isinstance(model.__dict__[k], ObjectIdDescriptor):
-            item_dict[k] = getattr(item, k)
-    return item_dict
+def hashing_unavailable():
+    """
+    Builds the error returned when the hashing pool is saturated.
+    """
+    return falcon.HTTPServiceUnavailable('Service unavailable', 'The server \
+is busy, please try again later', settings.hashing.retry_after)
 
 
 def last_page(count, items):
@@ -134,6 +581,175 @@ def last_page(count, items):
     return pages
 
 
+def build_last_page(count_mode, count, items, page, more):
+    """
+    Finds the last page. Without an exact count, it's the current page when
+    there are no more items, an estimate when counts are estimated and
+    otherwise unknown.
+    """
+    if count_mode == 'exact':
+        return last_page(count, items)
+    if not more:
+        return page
+    if count is not None:
+        return max(last_page(count, items), page + 1)
+    return None
+
+
+class StreamedPage(object):
+    """
+    Iterates the rows of a streamed page in chunks, reading one row more than
+    the page size to know whether a next page exists.
+    """
+    def __init__(self, rows, items, chunk=100):
+        self.rows = rows
+        self.items = items
+        self.chunk = chunk
+        self.more = False
+
+    def __iter__(self):
+        chunk = []
+        for number, row in enumerate(self.rows):
+            if number == self.items:
+                self.more = True
+                break
+            chunk.append(row)
+            if len(chunk) == self.chunk:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def stream_page(request, response, user, descriptor, query, page, items,
+                count_mode, fields, embeds):
+    """
+    Streams a page of a collection, reading the rows with a server-side
+    cursor and writing the JSON as they arrive, so that memory does not grow
+    with the page size. Without an exact count, whether there is a next page
+    is known only at the end, so the links are only in the body.
+    """
+    count = None
+    if count_mode == 'exact':
+        count = query.count()
+    elif count_mode == 'estimate':
+        count = estimate_count(query)
+    rows = ServerSide(query.limit(items + 1).offset((page - 1) * items))
+    try:
+        first_row = next(rows)
+    except StopIteration:
+        response.status = falcon.HTTP_NO_CONTENT
+        return response
+
+    serializer = descriptor.row_serializer(query, fields)
+    streamed_page = StreamedPage(chain([first_row], rows), items)
+
+    def build_items():
+        for chunk in streamed_page:
+            embedded = load_embeds(user, descriptor, serializer, chunk,
+                                   embeds)
+            for row in chunk:
+                yield build_item(serializer, row, embedded)
+
+    def build_links(length):
+        pages = build_last_page(count_mode, count, items, page,
+                                streamed_page.more)
+        return page_links(request.path, page, pages)
+
+    if count_mode == 'exact' and count > items:
+        build_link_headers(request, response, count, items, page)
+    stream = hinder_stream(build_items(), path=request.path,
+                           links=build_links)
+    if db.keep_statement_timeout():
+        stream = timed_stream(stream, rows)
+    response.stream = stream
+
+
+def timed_stream(stream, rows):
+    """
+    Streams with the statement timeout kept from the request, so that it
+    applies to the fetches of the server-side cursor too, resetting it when
+    the stream ends or is closed. The rows are closed first, so that their
+    transaction is over and cannot roll back the reset.
+    """
+    try:
+        for chunk in stream:
+            yield chunk
+    finally:
+        stream.close()
+        rows.close()
+        db.reset_statement_timeout()
+
+
+def response_key(descriptor, request, user):
+    """
+    Builds the key of a response, used by the responses cache and the etags.
+    Admins see every item, so they share their responses; other users have
+    their own, since their rules may differ.
+    """
+    params = []
+    for key, value in sorted(request.params.items()):
+        if isinstance(value, list):
+            value = tuple(value)
+        params.append((key, value))
+    scope = 'admin'
+    if user.rank != 10:
+        scope = (user.id, user.rank)
+    return (descriptor.model._meta.db_table, request.path, tuple(params),
+            scope)
+
+
+def response_tables(descriptor, params):
+    """
+    Finds the tables whose changes invalidate a collection response: the
+    model's table and the tables of the embedded items.
+    """
+    tables = set([descriptor.model._meta.db_table])
+    for embed in build_embeds(params):
+        if embed in descriptor.foreign_keys:
+            related = descriptor.foreign_keys[embed].rel_model
+            tables.add(related._meta.db_table)
+    return tables
+
+
+def etag_matches(header, etag):
+    """
+    Tells whether an If-None-Match header matches an etag, using the weak
+    comparison that conditional GETs require.
+    """
+    for i in header.split(','):
+        i = i.strip()
+        if i == '*' or i.replace('W/', '', 1) == etag:
+            return True
+    return False
+
+
+def not_modified(request, response, key, tables):
+    """
+    Sets the ETag and Last-Modified of a response from the versions of the
+    tables it depends on, and the key of the response. Returns True when
+    the client's copy is still fresh, leaving a 304 response.
+    """
+    tables = set(tables) | set([AccessRules._meta.db_table])
+    versions = TableVersions.read(tables)
+    state = (key, sorted((table, versions[table][0]) for table in versions))
+    etag = '"{}"'.format(hashlib.sha1(repr(state).encode()).hexdigest())
+    response.etag = etag
+    modified = [i[1] for i in versions.values() if i[1] is not None]
+    if modified:
+        response.last_modified = max(modified)
+
+    fresh = False
+    if request.if_none_match is not None:
+        fresh = etag_matches(request.if_none_match, etag)
+    elif request.if_modified_since is not None and modified:
+        last_modified = max(modified).replace(microsecond=0)
+        fresh = last_modified <= request.if_modified_since
+    if fresh:
+        response.status = falcon.HTTP_NOT_MODIFIED
+    return fresh
+
+
 def on_get(self, request, response):
     user = None
     if request.auth:
@@ -143,52 +759,141 @@ def on_get(self, request, response):
         raise falcon.HTTPUnauthorized('Login required', 'Please login',
                                       ['Basic realm="Login Required"'])
 
-    columns = model_columns(self.model)
-    params = {}
-    for i in columns:
-        if i in request.params:
-            params[i] = request.params[i]
+    if '_explain' in request.params:
+        return explain_collection(self, request, response, user)
+
+    key = response_key(self.descriptor, request, user)
+    tables = response_tables(self.descriptor, request.params)
+    if not_modified(request, response, key, tables):
+        return
+
+    if responses_cache.size < 1:
+        with query_limits(request, user):
+            return get_collection(self, request, response, user)
+
+    cached = responses_cache.get(key)
+    if cached is not None:
+        response.status = cached['status']
+        response.data = cached['data']
+        if cached['links'] is not None:
+            response.set_header('Link', cached['links'])
+        response.set_header('X-Cache', 'HIT')
+        return
+
+    with query_limits(request, user):
+        get_collection(self, request, response, user)
+    response.set_header('X-Cache', 'MISS')
+    if response.stream is None:
+        cached = {'status': response.status, 'data': response.data,
+                  'links': response.get_header('Link'),
+                  'tables': tables}
+        responses_cache.set(key, cached)
+
+
+@contextmanager
+def query_limits(request, user, explain=False):
+    """
+    Runs the queries of a GET request with its route and user, under the
+    statement timeout. Cancelled queries give a 400 response.
+    """
+    try:
+        with db.query_context(request.path, user.id, explain) as plans:
+            with db.statement_timeout():
+                yield plans
+    except QueryCanceledError:
+        raise falcon.HTTPBadRequest('Query timeout', 'The query took too \
+long, try a smaller page or more specific arguments')
+
 
-    page = 1
-    if 'page' in request.params:
-        page = int(request.params['page'])
+def explain_collection(self, request, response, user):
+    """
+    Runs a collection request recording the plans of its queries, that are
+    returned instead of the items. Only admins can explain requests.
+    """
+    if user.rank != 10:
+        raise falcon.HTTPForbidden('Forbidden access', 'Only admins can \
+explain requests')
+    with query_limits(request, user, explain=True) as plans:
+        get_collection(self, request, response, user)
+    response.status = falcon.HTTP_OK
+    response.data = dumps({'queries': plans})
 
-    items = 20
-    if 'items' in request.params:
-        items = int(request.params['items'])
 
-    order = None
-    if 'order_by' in request.params:
-        order = request.params['order_by']
+@post_save()
+def on_item_save(model_class, instance, created):
+    """
+    Invalidates the cached collection responses that depend on the table of
+    a saved item. Changing a rule can change any response.
+    """
+    if model_class == AccessRules:
+        responses_cache.clear()
+        return
+    table = instance._meta.db_table
+    responses_cache.invalidate(lambda key, value: table in value['tables'])
 
+
+@post_delete()
+def on_item_delete(model_class, instance):
+    on_item_save(model_class, instance, False)
+
+
+def get_collection(self, request, response, user):
+    descriptor = self.descriptor
+    params = {i: request.params[i] for i in descriptor.columns
+              if i in request.params}
+    page, items, order = build_pagination(request.params)
+    check_items(self.model, items)
+    check_columns(self.model, 'filterable', params)
     embeds = build_embeds(request.params)
     fields = build_fields(request.params)
 
-    query = build_query(self.model, params)
-    if order is not None:
-        query = build_order(self.model, query, order)
-    count = query.count()
-
+    projection = build_projection(descriptor, fields, embeds)
+    query = build_query(self.model, params, projection)
+    query = user.filter_query('read', self.model, query).tuples()
+    if 'q' in request.params:
+        ranked = order is None and 'cursor' not in request.params
+        query = build_search(self.model, query, request.params['q'], ranked)
+    cursors = None
+    if 'cursor' in request.params:
+        cursor = request.params['cursor']
+        rows, cursors, query = paginate_by_cursor(descriptor, query, cursor,
+                                                  order, items)
+    else:
+        if order is not None:
+            query = build_order(self.model, query, order)
+        count_mode = build_count_mode(self.model, request.params)
+        stream_items = settings.collections.stream_items
+        if 0 < stream_items <= items and '_explain' not in request.params:
+            return stream_page(request, response, user, descriptor, query,
+                               page, items, count_mode, fields, embeds)
+        rows, count, more = paginate_by_page(query, page, items, count_mode)
+
+    rows = list(rows)
+    serializer = descriptor.row_serializer(query, fields)
+    embedded = load_embeds(user, descriptor, serializer, rows, embeds)
     body = []
-    for i in query.paginate(page, items):
-        if user.can('read', i):
-            item = build_item(columns, fields, i, embeds)
-            body.append(item)
+    for i in rows:
+        item = build_item(serializer, i, embedded)
+        body.append(item)
 
     if len(body) == 0:
         response.status = falcon.HTTP_NO_CONTENT
         return response
 
-    def json_serial(obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        raise TypeError('Type not serializable')
-    pages = last_page(count, items)
-    s = hinder(body, path=request.path, page=page, last_page=pages)
-    response.body = json.dumps(s, default=json_serial)
+    if cursors is not None:
+        s = hinder(body, path=request.path, cursors=cursors, items=items)
+        response.data = dumps(s)
+        build_link_headers(request, response, None, items, None, cursors)
+        return
 
-    if count > items:
-        build_link_headers(request, response, count, items, page)
+    pages = build_last_page(count_mode, count, items, page, more)
+    s = hinder(body, path=request.path, page=page, last_page=pages)
+    response.data = dumps(s)
+    if count_mode == 'exact':
+        if count > items:
+            build_link_headers(request, response, count, items, page)
+    elif more or page > 1:
+        build_link_headers(request, response, count, items, page, more=more)
 
 
 def on_post(self, request, response):
@@ -208,13 +913,15 @@ def on_post(self, request, response):
         with db.atomic():
             try:
                 new_item.save()
+            except HashingPoolFull:
+                raise hashing_unavailable()
             except:
                 raise falcon.HTTPInternalServerError('Internal error', 'The \
     requested operation cannot be completed')
         response.status = falcon.HTTP_CREATED
         path = '{}/{}'.format(request.path, new_item.id)
         s = hinder(new_item.__dict__['_data'], path=path)
-        response.body = json.dumps(s)
+        response.data = dumps(s)
     else:
         raise falcon.HTTPForbidden('Forbidden access', 'You do not have the \
 required permissions for this action')
@@ -229,21 +936,25 @@ def on_get_resource(self, request, response, id=0):
         raise falcon.HTTPUnauthorized('Login required', 'Please login',
                                       ['Basic realm="Login Required"'])
 
+    key = response_key(self.descriptor, request, user)
+    if not_modified(request, response, key, [self.model._meta.db_table]):
+        return
+
+    fields = 'all'
+    if '_fields' in request.params:
+        fields = build_fields(request.params)
+    projection = build_projection(self.descriptor, fields, [])
     try:
-        item = self.model.get(getattr(self.model, 'id') == id)
+        item = self.model.select(*projection)\
+            .where(getattr(self.model, 'id') == id).get()
     except:
         description = 'The resource you are looking for does not exist'
         raise falcon.HTTPNotFound(title='Not found', description=description)
 
     if user.can('read', item):
-        item_dict = item_to_dictionary(self.model, item)
-
-        def json_serial(obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            raise TypeError('Type not serializable')
+        item_dict = self.descriptor.to_dictionary(item, fields)
         s = hinder(item_dict, path=request.path)
-        response.body = json.dumps(s, default=json_serial)
+        response.data = dumps(s)
     else:
         raise falcon.HTTPForbidden('Forbidden access', 'You do not have the \
 required permissions for this action')
@@ -265,19 +976,20 @@ def on_patch_resource(self, request, response, id=0):
         raise falcon.HTTPNotFound(title='Not found', description=description)
 
     if user.can('edit', item):
-        stream = request.stream.read().decode('UTF-8')
-        parsed_stream = json.loads(stream)
+        parsed_stream = loads(request.stream.read())
         for key in parsed_stream:
             setattr(item, key, parsed_stream[key])
         with db.atomic():
             try:
                 item.save()
+            except HashingPoolFull:
+                raise hashing_unavailable()
             except:
                 raise falcon.HTTPInternalServerError('Internal error', 'The \
     requested operation cannot be completed')
-        item_dict = item_to_dictionary(self.model, item)
+        item_dict = self.descriptor.to_dictionary(item)
         s = hinder(item_dict, path=request.path)
-        response.body = json.dumps(s)
+        response.data = dumps(s)
     else:
         raise falcon.HTTPForbidden('Forbidden access', 'You do not have the \
 required permissions for this action')
@@ -317,6 +1029,7 @@ def make_collection(model):
     """
     attributes = {
         'model': model,
+        'descriptor': ModelDescriptor(model),
         'on_get': on_get,
         'on_post': on_post
     }
@@ -326,6 +1039,7 @@ def make_collection(model):
 def make_resource(model):
     attributes = {
         'model': model,
+        'descriptor': ModelDescriptor(model),
         'on_get': on_get_resource,
         'on_patch': on_patch_resource,
         'on_delete': on_delete_resource
@@ -333,6 +1047,30 @@ def make_resource(model):
     return type('mycollection', (object, ), attributes)
 
 
+class StatsResource:
+    """
+    The StatsResource resource reports the entries and the hits/misses
+    counters of the caches of the process that serves the request. Only
+    admins can read them.
+    """
+    def on_get(self, request, response):
+        user = None
+        if request.auth:
+            user = authenticate_by_token(request.auth)
+
+        if user is None:
+            raise falcon.HTTPUnauthorized('Login required', 'Please login',
+                                          ['Basic realm="Login Required"'])
+
+        if user.rank != 10:
+            raise falcon.HTTPForbidden('Forbidden access', 'Only admins can \
+read the statistics')
+        caches = {'permissions': permissions_cache,
+                  'principals': principals_cache, 'tokens': tokens_cache,
+                  'users': users_cache, 'responses': responses_cache}
+        response.data = dumps({name: caches[name].stats() for name in caches})
+
+
 class TokensResource:
     """
     The TokensResource resource handles tokens requests.
@@ -344,8 +1082,11 @@ class TokensResource:
             raise falcon.HTTPBadRequest('Bad request',
                                         'A required parameter is missing')
 
-        authentication = authenticate_by_password(request.params['username'],
-                                                  request.params['password'])
+        try:
+            authentication = authenticate_by_password(
+                request.params['username'], request.params['password'])
+        except HashingPoolFull:
+            raise hashing_unavailable()
         if authentication is None:
             raise falcon.HTTPForbidden('Forbidden access',
                                        'The credentials provided are invalid')
@@ -355,18 +1096,22 @@ class TokensResource:
                 t = EternalTokens.get(
                     EternalTokens.name == request.params['token_name'],
                     EternalTokens.user == authentication.id
-                ).token
+                )
             except:
                 raise falcon.HTTPForbidden('Forbidden access',
                                            'The credentials provided are \
 invalid')
-            token = generate_token(token=t)
+            if settings.security.stateless_tokens:
+                token = generate_token(uid=authentication.id, tid=t.id,
+                                       gen=t.generation)
+            else:
+                token = generate_token(token=t.token)
         else:
-            expiration = config.parser.getint('security', 'token_expiration')
-            token = generate_token(expiration=expiration,
-                                   user=request.params['username'])
+            token = generate_token(
+                expiration=settings.security.token_expiration,
+                user=request.params['username'])
         response.status = falcon.HTTP_OK
-        response.body = json.dumps({'token': token})
+        response.data = dumps({'token': token})
 
 
 class RootResource:
@@ -377,4 +1122,4 @@ class RootResource:
         self.data = data
 
     def on_get(self, request, response):
-        response.body = json.dumps(self.data)
+        response.data = dumps(self.data)
@@ -17,6 +17,7 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+from .Codec import dumps
 
 
 def make_entities(data, path=None):
@@ -41,7 +42,41 @@ def make_entities(data, path=None):
     return entities
 
 
-def hinder(data, cls=None, path=None, page=None, last_page=None):
+def cursor_links(path, cursors, items=None):
+    links = [{'rel': ['self'], 'href': path}]
+    for rel in ['previous', 'next']:
+        if rel in cursors:
+            href = '{}?cursor={}'.format(path, cursors[rel])
+            if items:
+                href = '{}&items={}'.format(href, items)
+            links.append({'rel': [rel], 'href': href})
+    return links
+
+
+def page_links(path, page, last_page=None):
+    current_path = '{}?page={}'.format(path, page)
+    if page == 1:
+        current_path = path
+    links = [{'rel': ['self'], 'href': current_path}]
+    if page > 1:
+        prev_path = '{}?page={}'.format(path, page - 1)
+        prev = {'rel': ['previous'], 'href': prev_path}
+        links.append(prev)
+    if last_page:
+        last_path = '{}?page={}'.format(path, last_page)
+        links.append({'rel': ['last'], 'href': last_path})
+        if last_page > page:
+            next_path = '{}?page={}'.format(path, page + 1)
+            next = {'rel': ['next'], 'href': next_path}
+            links.append(next)
+    else:
+        next_path = '{}?page={}'.format(path, page + 1)
+        links.append({'rel': ['next'], 'href': next_path})
+    return links
+
+
+def hinder(data, cls=None, path=None, page=None, last_page=None,
+           cursors=None, items=None):
     siren = {}
     if type(data) == dict:
         siren['properties'] = data
@@ -50,30 +85,43 @@ def hinder(data, cls=None, path=None, page=None, last_page=None):
     elif type(data) == list:
         siren['properties'] = {'count': len(data)}
         if path:
-            if page == None:
+            if cursors is not None:
+                siren['links'] = cursor_links(path, cursors, items)
+            elif page == None:
                 siren['links'] = [{'rel': ['self'], 'href': path}]
             elif page > 0:
-                current_path = '{}?page={}'.format(path, page)
-                if page == 1:
-                    current_path = path
-                siren['links'] = [{'rel': ['self'], 'href': current_path}]
-                if page > 1:
-                    prev_path = '{}?page={}'.format(path, page - 1)
-                    prev = {'rel': ['previous'], 'href': prev_path}
-                    siren['links'].append(prev)
-                if last_page:
-                    last_path = '{}?page={}'.format(path, last_page)
-                    siren['links'].append({'rel': ['last'], 'href': last_path})
-                    if last_page > page:
-                        next_path = '{}?page={}'.format(path, page + 1)
-                        next = {'rel': ['next'], 'href': next_path}
-                        siren['links'].append(next)
-                else:
-                    next_path = '{}?page={}'.format(path, page + 1)
-                    siren['links'].append({'rel': ['next'], 'href': next_path})
+                siren['links'] = page_links(path, page, last_page)
 
         siren['entities'] = make_entities(data, path)
 
     if cls:
         siren['class'] = [cls]
     return siren
+
+
+def hinder_stream(data, cls=None, path=None, links=None, chunk=100):
+    """
+    Encodes a collection like hinder, yielding the JSON in chunks of bytes
+    as data is iterated, so that the collection is never entirely in memory.
+    Since the number of items is known only at the end, links is a function
+    called with it after the last item, that returns the collection links.
+    """
+    yield b'{"entities": ['
+    count = 0
+    entities = []
+    for item in data:
+        entities.append(dumps(make_entities([item], path)[0]))
+        count += 1
+        if len(entities) == chunk:
+            if count > chunk:
+                entities.insert(0, b'')
+            yield b', '.join(entities)
+            entities = []
+    if entities and count > len(entities):
+        entities.insert(0, b'')
+    siren = {'properties': {'count': count}}
+    if links:
+        siren['links'] = links(count)
+    if cls:
+        siren['class'] = [cls]
+    yield b', '.join(entities) + b'], ' + dumps(siren)[1:]
@@ -28,6 +28,9 @@ setup(
         'itsdangerous>=0.24',
         'colorama>=0.3.3'
     ],
+    extras_require={
+        'fast': ['orjson']
+    },
     classifiers=[
         'Intended Audience :: Developers',
         'Development Status :: 4 - Beta',
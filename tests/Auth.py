@@ -9,10 +9,18 @@ import json
 import sys
 import time
 
-from efesto.Auth import (authenticate_by_password, authenticate_by_token,
-                         generate_token, parse_auth_header, read_token)
-from efesto.Base import config
-from itsdangerous import (JSONWebSignatureSerializer as Serializer,
+from efesto import Auth
+from efesto.Auth import (Revocations, authenticate_by_eternal_token,
+                         authenticate_by_password,
+                         authenticate_by_stateless_token,
+                         authenticate_by_token, generate_token, make_verifiers,
+                         parse_auth_header, principals_cache, read_token,
+                         revocations, tokens_cache)
+from efesto.Base import config, settings
+from efesto.Crypto import pbkdf2_hex
+from efesto.Models import EternalTokens, RevokedTokens, Users
+from itsdangerous import (BadSignature,
+                          JSONWebSignatureSerializer as Serializer,
                           SignatureExpired,
                           TimedJSONWebSignatureSerializer as TimedSerializer)
 import pytest
@@ -80,6 +88,25 @@ def test_read_token_eternal():
     assert token_dict == {'token': 'somestring'}
 
 
+def test_read_token_bad_signature():
+    """
+    Verifies that read_token refuses tokens signed with an unknown secret.
+    """
+    token = TimedSerializer('unknown').dumps({'user': 'random'})
+    with pytest.raises(BadSignature):
+        read_token(token)
+
+
+def test_read_token_previous_secret(monkeypatch):
+    """
+    Verifies that tokens signed with a previous secret are still accepted.
+    """
+    secrets = (settings.security.secret, 'old', 'older')
+    monkeypatch.setattr(Auth, 'verifiers', make_verifiers(secrets))
+    token = TimedSerializer('older').dumps({'user': 'random'})
+    assert read_token(token) == {'user': 'random'}
+
+
 def test_password_authentication_failure():
     assert authenticate_by_password('myuser', 'mypasswd') == None
 
@@ -98,6 +125,46 @@ def test_password_authentication(dummy_user):
     assert authenticate_by_password(dummy_user.name, 'sample') == dummy_user
 
 
+def test_password_authentication_rehash(request):
+    """
+    Verifies that passwords hashed with less iterations are hashed again
+    when the user logs in.
+    """
+    user = Users(name='rehasheduser', email='mail', password='sample',
+                 rank=0, enabled=1)
+    user.save()
+    request.addfinalizer(user.delete_instance)
+    splitted = user.password.split('$')
+    splitted[1] = '10'
+    splitted[3] = pbkdf2_hex('sample', splitted[2], iterations=10,
+                             keylen=len(splitted[3]) // 2)
+    Users.update(password='$'.join(splitted))\
+        .where(Users.id == user.id).execute()
+    assert authenticate_by_password(user.name, 'sample') == user
+    rehashed = Users.get(Users.id == user.id).password
+    assert rehashed.split('$')[1] == config.parser.get('security',
+                                                       'iterations')
+
+
+def test_password_authentication_rehash_failure(request, monkeypatch):
+    """
+    Verifies that a failed rehash keeps the old hash and the login working.
+    """
+    user = Users(name='rehashfailure', email='mail', password='sample',
+                 rank=0, enabled=1)
+    user.save()
+    request.addfinalizer(user.delete_instance)
+    monkeypatch.setattr(Auth, 'needs_rehash', lambda password: True)
+
+    def failing_update(**kwargs):
+        raise ValueError()
+    monkeypatch.setattr(Users, 'update', failing_update)
+    authenticated = authenticate_by_password(user.name, 'sample')
+    assert authenticated == user
+    assert authenticated.password == user.password
+    assert 'password' not in authenticated._dirty
+
+
 def test_parse_auth_header():
     original_string = 'myuser:mypasswd'
     encoded_string = original_string.encode('latin-1')
@@ -154,3 +221,185 @@ def test_token_authentication_eternal(dummy_admin, token):
     auth_string = 'Basic %s' % (string64)
     result = authenticate_by_token(auth_string)
     assert result == dummy_admin
+
+
+def test_token_authentication_cache(dummy_user):
+    """
+    Verifies that token authentications are cached.
+    """
+    token = generate_token(decode=True, user=dummy_user.name)
+    original_string = ':{}'.format(token)
+    encoded_string = original_string.encode('latin-1')
+    string64 = base64.b64encode(encoded_string).decode('latin-1')
+    auth_string = 'Basic %s' % (string64)
+    authenticate_by_token(auth_string)
+    hits = principals_cache.hits
+    assert authenticate_by_token(auth_string) == dummy_user
+    assert principals_cache.hits == hits + 1
+
+
+def test_token_authentication_cache_disabled_user(request):
+    """
+    Verifies that disabling an user removes its cached authentications.
+    """
+    user = Users(name='cacheduser', email='mail', password='sample', rank=0,
+                 enabled=1)
+    user.save()
+    request.addfinalizer(user.delete_instance)
+    token = generate_token(decode=True, user=user.name)
+    original_string = ':{}'.format(token)
+    encoded_string = original_string.encode('latin-1')
+    string64 = base64.b64encode(encoded_string).decode('latin-1')
+    auth_string = 'Basic %s' % (string64)
+    assert authenticate_by_token(auth_string) == user
+    user.enabled = 0
+    user.save()
+    assert authenticate_by_token(auth_string) is None
+
+
+def test_eternal_token_authentication(dummy_admin, token):
+    """
+    Verifies that authenticate_by_eternal_token finds the token's user and
+    caches it.
+    """
+    assert authenticate_by_eternal_token(token.token) == dummy_admin
+    hits = tokens_cache.hits
+    assert authenticate_by_eternal_token(token.token) == dummy_admin
+    assert tokens_cache.hits == hits + 1
+
+
+def test_eternal_token_authentication_expiry(dummy_admin, monkeypatch):
+    """
+    Verifies that cached eternal tokens expire, so that tokens deleted by
+    other processes are eventually refused.
+    """
+    new_token = EternalTokens(name='expiring', user=dummy_admin.id, token='')
+    new_token.save()
+    assert authenticate_by_eternal_token(new_token.token) == dummy_admin
+    EternalTokens.delete().where(EternalTokens.id == new_token.id).execute()
+    assert authenticate_by_eternal_token(new_token.token) == dummy_admin
+    now = time.time()
+    monkeypatch.setattr(time, 'time',
+                        lambda: now + settings.cache.principals_ttl + 1)
+    assert authenticate_by_eternal_token(new_token.token) is None
+
+
+def test_eternal_token_authentication_not_found():
+    assert authenticate_by_eternal_token('notatoken') is None
+
+
+def test_eternal_token_authentication_revoked(dummy_admin):
+    """
+    Verifies that deleting an eternal token removes it from the cache.
+    """
+    new_token = EternalTokens(name='revoked', user=dummy_admin.id, token='')
+    new_token.save()
+    assert authenticate_by_eternal_token(new_token.token) == dummy_admin
+    new_token.delete_instance()
+    assert authenticate_by_eternal_token(new_token.token) is None
+
+
+def test_stateless_token_authentication(dummy_admin, token):
+    token_dict = {'uid': dummy_admin.id, 'tid': token.id}
+    assert authenticate_by_stateless_token(token_dict) == dummy_admin
+
+
+def test_stateless_token_authentication_header(dummy_admin, token):
+    """
+    Verifies that authenticate_by_token accepts stateless tokens.
+    """
+    generated_token = generate_token(uid=dummy_admin.id, tid=token.id)
+    original_string = ':{}'.format(generated_token)
+    encoded_string = original_string.encode('latin-1')
+    string64 = base64.b64encode(encoded_string).decode('latin-1')
+    auth_string = 'Basic %s' % (string64)
+    assert authenticate_by_token(auth_string) == dummy_admin
+
+
+def test_stateless_token_authentication_revoked(dummy_admin):
+    """
+    Verifies that stateless tokens are refused once their eternal token is
+    deleted.
+    """
+    new_token = EternalTokens(name='stateless', user=dummy_admin.id, token='')
+    new_token.save()
+    token_dict = {'uid': dummy_admin.id, 'tid': new_token.id}
+    assert authenticate_by_stateless_token(token_dict) == dummy_admin
+    new_token.delete_instance()
+    assert revocations.revoked(new_token.id)
+    assert authenticate_by_stateless_token(token_dict) is None
+
+
+def test_stateless_token_authentication_regenerated(dummy_admin):
+    """
+    Verifies that regenerating an eternal token refuses the stateless tokens
+    issued before, but not the ones issued after.
+    """
+    new_token = EternalTokens(name='rotated', user=dummy_admin.id, token='')
+    new_token.save()
+    token_dict = {'uid': dummy_admin.id, 'tid': new_token.id, 'gen': 0}
+    new_token.token = ''
+    new_token.save()
+    assert new_token.generation == 1
+    assert authenticate_by_stateless_token(token_dict) is None
+    assert authenticate_by_stateless_token({'uid': dummy_admin.id,
+                                            'tid': new_token.id}) is None
+    token_dict['gen'] = new_token.generation
+    assert authenticate_by_stateless_token(token_dict) == dummy_admin
+    new_token.delete_instance()
+
+
+def test_stateless_token_authentication_reassigned(dummy_admin):
+    """
+    Verifies that giving an eternal token to another user refuses the
+    stateless tokens issued to the previous one.
+    """
+    user = Users(name='new_owner', email='mail', password='p', rank=1,
+                 enabled=1)
+    user.save()
+    new_token = EternalTokens(name='reassigned', user=dummy_admin.id,
+                              token='')
+    new_token.save()
+    token_dict = {'uid': dummy_admin.id, 'tid': new_token.id, 'gen': 0}
+    new_token.user = user.id
+    new_token.save()
+    assert Revocations().revoked(new_token.id, 0)
+    assert authenticate_by_stateless_token(token_dict) is None
+    assert authenticate_by_stateless_token({'uid': user.id,
+                                            'tid': new_token.id,
+                                            'gen': 1}) == user
+    new_token.name = 'renamed'
+    new_token.save()
+    assert new_token.generation == 1
+    new_token.delete_instance()
+    user.delete_instance()
+
+
+def test_stateless_token_authentication_disabled_elsewhere(monkeypatch):
+    """
+    Verifies that users disabled by other processes are refused after
+    security.revocations_refresh.
+    """
+    user = Users(name='stateless_user', email='mail', password='p', rank=1,
+                 enabled=1)
+    user.save()
+    token_dict = {'uid': user.id, 'tid': 0}
+    assert authenticate_by_stateless_token(token_dict) == user
+    Users.update(enabled=False).where(Users.id == user.id).execute()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now +
+                        settings.security.revocations_refresh + 1)
+    assert authenticate_by_stateless_token(token_dict) is None
+    user.delete_instance()
+
+
+def test_revocations_load(dummy_admin):
+    """
+    Verifies that Revocations loads revocations made by other processes.
+    """
+    revocation = RevokedTokens.create(token=12345, user=dummy_admin.id,
+                                      generation=2)
+    assert Revocations().revoked(12345, 2)
+    assert Revocations().revoked(12345, 1)
+    assert Revocations().revoked(12345, 3) == False
+    revocation.delete_instance()
@@ -22,7 +22,7 @@ import sys
 from configparser import ConfigParser
 
 from efesto.Blueprints import dump_blueprint, load_blueprint
-from efesto.Models import Fields, Types
+from efesto.Models import Fields, Indexes, Types
 import pytest
 
 
@@ -110,6 +110,24 @@ def nullable_blueprint(request, complex_blueprint, blueprint_file):
     request.addfinalizer(teardown)
 
 
+@pytest.fixture
+def indexed_blueprint(request, complex_blueprint, blueprint_file):
+    parser = ConfigParser()
+    parser.read(blueprint_file)
+    parser.set('plants.weight', 'indexed', 'True')
+    parser.set('plants.age', 'searchable', 'True')
+    parser.add_section('plants.index.by_colour')
+    parser.set('plants.index.by_colour', 'columns', 'colour, weight DESC')
+    parser.set('plants.index.by_colour', 'unique', 'True')
+    with open(blueprint_file, 'w') as f:
+        parser.write(f)
+
+    def teardown():
+        index = Indexes.get(Indexes.name == 'by_colour')
+        index.delete_instance()
+    request.addfinalizer(teardown)
+
+
 @pytest.fixture
 def simple_data(request, blueprint_file):
     bands = Types(name='bands', enabled=0)
@@ -205,6 +223,28 @@ def test_nullable_blueprint(nullable_blueprint, blueprint_file):
     assert field.nullable == True
 
 
+def test_indexed_blueprint(indexed_blueprint, blueprint_file):
+    """
+    Verifies that blueprints round-trip indexed fields and indexes.
+    """
+    load_blueprint(blueprint_file)
+    field = Fields.get(Fields.name == 'weight')
+    assert field.indexed == True
+    assert Fields.get(Fields.name == 'age').searchable == True
+    index = Indexes.get(Indexes.name == 'by_colour')
+    assert index.columns == 'colour, weight DESC'
+    assert index.unique == True
+
+    dump_blueprint(blueprint_file)
+    parser = ConfigParser()
+    parser.read(blueprint_file)
+    assert parser.getboolean('plants.weight', 'indexed') == True
+    assert parser.getboolean('plants.age', 'searchable') == True
+    assert parser.get('plants.index.by_colour', 'columns') == \
+        'colour, weight DESC'
+    assert parser.getboolean('plants.index.by_colour', 'unique') == True
+
+
 def test_dump_simple_blueprint(simple_data, blueprint_file):
     """
     Tests the dumping of a simple blueprint.
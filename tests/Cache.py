@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+    The Cache test case.
+
+    Tests the Cache module.
+"""
+import sys
+import time
+
+from efesto.Cache import Cache
+import pytest
+
+
+sys.path.insert(0, '')
+
+
+@pytest.fixture
+def cache():
+    return Cache(size=2)
+
+
+def test_cache_get(cache):
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+
+
+def test_cache_get_default(cache):
+    assert cache.get('key') == None
+    assert cache.get('key', 'default') == 'default'
+
+
+def test_cache_size(cache):
+    """
+    Verifies that the least recently used entry is evicted.
+    """
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') == None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_cache_disabled():
+    """
+    Verifies that a cache with size 0 does not store anything.
+    """
+    cache = Cache(size=0)
+    cache.set('a', 1)
+    assert cache.get('a') == None
+
+
+def test_cache_delete(cache):
+    cache.set('a', 1)
+    cache.delete('a')
+    cache.delete('b')
+    assert cache.get('a') == None
+
+
+def test_cache_invalidate(cache):
+    cache.set((1, 'a'), 1)
+    cache.set((2, 'a'), 2)
+    cache.invalidate(lambda key, value: key[0] == 1)
+    assert cache.get((1, 'a')) == None
+    assert cache.get((2, 'a')) == 2
+
+
+def test_cache_clear(cache):
+    cache.set('a', 1)
+    cache.clear()
+    assert cache.get('a') == None
+
+
+def test_cache_stats(cache):
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+    assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+
+def test_cache_ttl():
+    """
+    Verifies that entries expire after the cache ttl.
+    """
+    cache = Cache(size=2, ttl=0)
+    cache.set('a', 1)
+    time.sleep(0.01)
+    assert cache.get('a') == None
+    assert cache.stats()['entries'] == 0
+
+
+def test_cache_expires(cache):
+    """
+    Verifies that entries expire at the given timestamp.
+    """
+    cache.set('a', 1, expires=time.time() - 1)
+    cache.set('b', 2, expires=time.time() + 60)
+    assert cache.get('a') == None
+    assert cache.get('b') == 2
+
+
+def test_cache_expires_capped():
+    """
+    Verifies that the cache ttl caps the expiration given for an entry.
+    """
+    cache = Cache(size=2, ttl=0)
+    cache.set('a', 1, expires=time.time() + 60)
+    time.sleep(0.01)
+    assert cache.get('a') == None
+
+
+def test_cache_invalidate_by_value(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate(lambda key, value: value == 2)
+    assert cache.get('a') == 1
+    assert cache.get('b') == None
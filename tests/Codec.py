@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    The Codec test case.
+
+    Tests the Codec module with each of the available implementations.
+"""
+import sys
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from efesto import Codec
+import pytest
+
+
+sys.path.insert(0, '')
+
+
+implementations = [(Codec.stdlib_dumps, Codec.stdlib_loads)]
+if Codec.orjson is not None:
+    implementations.append((Codec.orjson_dumps, Codec.orjson_loads))
+
+
+@pytest.fixture(params=implementations)
+def codec(request):
+    return request.param
+
+
+def test_dumps_bytes(codec):
+    result = codec[0]({'id': 1})
+    assert isinstance(result, bytes)
+    assert codec[1](result) == {'id': 1}
+
+
+@pytest.mark.parametrize('value, expected', [
+    (datetime(2016, 4, 20, 10, 30), '2016-04-20T10:30:00'),
+    (date(2016, 4, 20), '2016-04-20'),
+    (time(10, 30), '10:30:00'),
+    (Decimal('3.10'), '3.10')
+])
+def test_dumps_types(codec, value, expected):
+    dumps, loads = codec
+    assert loads(dumps({'value': value})) == {'value': expected}
+
+
+def test_dumps_unsupported(codec):
+    with pytest.raises(TypeError):
+        codec[0]({'value': object()})
+
+
+@pytest.mark.parametrize('data', [b'{"name": "\xc3\xa8"}',
+                                  '{"name": "è"}'])
+def test_loads(codec, data):
+    assert codec[1](data) == {'name': 'è'}
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 """
 """
+import itertools
 import json
 import re
 import sys
 
+from efesto import Base, Resources
+from efesto.Base import db, settings
+from efesto.Cache import Cache
 from efesto.Models import (AccessRules, EternalTokens, Fields, Types, Users,
                            make_model)
-from efesto.Resources import make_collection, model_columns
+from efesto.Resources import (ModelDescriptor, build_filter, build_projection,
+                              build_query, make_collection, model_columns,
+                              parse_order)
 import falcon
+from peewee import OP, SQL
 import pytest
 
 
@@ -54,6 +61,7 @@ def pagination_items(request):
         for i in items_list:
             i.delete_instance()
     request.addfinalizer(teardown)
+    return items_list
 
 
 @pytest.mark.parametrize('model', [Users, Types, Fields, AccessRules,
@@ -183,6 +191,160 @@ def test_make_collection_fields_argument_all(client, app, admin_auth,
             assert column in item['properties']
 
 
+def test_build_query_projection(item_with_model):
+    """
+    Verifies that only the requested fields are selected.
+    """
+    model = item_with_model[1]
+    descriptor = ModelDescriptor(model)
+    columns = model_columns(model)
+    columns.remove('id')
+    projection = build_projection(descriptor, ['id', columns[0]], [])
+    sql = build_query(model, {}, projection).sql()[0]
+    selected = sql.split(' FROM ')[0]
+    assert '"id"' in selected
+    assert '"%s"' % (descriptor.fields[columns[0]].db_column) in selected
+    for column in columns[1:]:
+        assert '"%s"' % (descriptor.fields[column].db_column) not in selected
+
+
+def test_build_projection_all(item_with_model):
+    descriptor = ModelDescriptor(item_with_model[1])
+    assert build_projection(descriptor, 'all', []) == []
+
+
+def test_row_serializer_unknown_fields():
+    """
+    Verifies that requesting unknown fields doesn't add serializers.
+    """
+    descriptor = ModelDescriptor(Users)
+    query = Users.select(Users.id, Users.name)
+    serializer = descriptor.row_serializer(query, ['id', 'name'])
+    for i in range(10):
+        fields = ['id', 'name', 'unknown%s' % (i)]
+        assert descriptor.row_serializer(query, fields) is serializer
+    assert len(descriptor.serializers) == 1
+
+
+@pytest.mark.parametrize('params, expected', [
+    ({'id': ['1', '2', '3']}, '"id" IN (%s, %s, %s)'),
+    ({'name': 'u1..u5'}, '"name" BETWEEN %s AND %s'),
+    ({'name': 'u1*'}, '"name" LIKE %s')
+])
+def test_build_query_filters(params, expected):
+    sql = build_query(Users, params).sql()[0]
+    assert expected in sql.split(' WHERE ')[1]
+
+
+def test_build_filter_prefix_not_text():
+    """
+    Verifies that prefixes are matched only on text fields.
+    """
+    assert build_filter(Users.rank, '1*').op == OP.EQ
+
+
+def test_build_query_prefix_escaped():
+    params = build_query(Users, {'name': 'u_1%*'}).sql()[1]
+    assert params == ['u\\_1\\%%']
+
+
+def test_build_query_foreign_key_column():
+    sql = build_query(EternalTokens, {'user_id': '1'}).sql()[0]
+    assert '"user_id" = %s' in sql
+
+
+@pytest.fixture
+def searchable_items(request, complex_type, complex_fields, dummy_admin):
+    field = Fields.get(Fields.name == 'strfield')
+    field.searchable = True
+    field.save()
+    complex_type.enabled = 1
+    complex_type.save()
+    model = make_model(complex_type)
+    items = []
+    texts = ['red roses and red tulips', 'a red rose', 'white lilies']
+    for i, text in enumerate(texts):
+        item = model(strfield=text, intfield=i, floatfield=1.0,
+                     datefield='2016-04-20', ufield='search%s' % (i),
+                     owner=dummy_admin.id)
+        item.save()
+        items.append(item)
+
+    def teardown():
+        for item in items:
+            item.delete_instance()
+    request.addfinalizer(teardown)
+    return model, items
+
+
+def test_make_collection_search(client, app, admin_auth, searchable_items):
+    """
+    Verifies that q returns the matching items, the best matches first.
+    """
+    model, items = searchable_items
+    resource = make_collection(model)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?q=red%20roses',
+                          headers={'authorization': admin_auth})
+    ids = [i['properties']['id'] for i in json.loads(response.body)[
+        'entities']]
+    assert ids == [items[0].id, items[1].id]
+
+
+def test_make_collection_search_pagination(client, app, admin_auth,
+                                           searchable_items):
+    model, items = searchable_items
+    resource = make_collection(model)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?q=rose&items=1&page=2&intfield=>1',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_NO_CONTENT
+    response = client.get('/endpoint?q=rose&items=1&page=2',
+                          headers={'authorization': admin_auth})
+    body = json.loads(response.body)
+    assert [i['properties']['id'] for i in body['entities']] == [items[1].id]
+
+
+def test_make_collection_search_not_searchable(client, app, admin_auth):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?q=admin',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_make_collection_batch(client, app, admin_auth, pagination_items):
+    """
+    Verifies that a list of ids fetches all the items in one page.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    ids = sorted([i.id for i in pagination_items])
+    url = '/endpoint?id=%s' % (','.join([str(i) for i in ids]))
+    response = client.get(url + '&items=1',
+                          headers={'authorization': admin_auth})
+    assert len(json.loads(response.body)['entities']) == 1
+    response = client.get(url, headers={'authorization': admin_auth})
+    entities = json.loads(response.body)['entities']
+    assert sorted([i['properties']['id'] for i in entities]) == ids
+    assert 'Link' not in response.headers
+
+
+@pytest.mark.parametrize('query, names', [
+    ('name=u7..u8', ['u7', 'u8']),
+    ('name=u8,u9', ['u8', 'u9']),
+    ('name=u8*', ['u8'])
+])
+def test_make_collection_query_multi(client, app, admin_auth,
+                                     pagination_items, query, names):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?%s&_fields=name' % (query)
+    response = client.get(url, headers={'authorization': admin_auth})
+    entities = json.loads(response.body)['entities']
+    assert sorted([i['properties']['name'] for i in entities]) == names
+
+
 @pytest.mark.parametrize('query', [
     'name=u7', 'rank=1', 'name=<u8', 'rank=1&name=!u3'
 ])
@@ -267,6 +429,114 @@ def test_make_collection_order_arg_desc(client, app, admin_auth,
         previous = item.name
 
 
+@pytest.mark.parametrize('order, expected', [
+    ('name', [('name', False), ('id', False)]),
+    ('<name', [('name', True), ('id', True)]),
+    (['<rank', '>name'], [('rank', True), ('name', False), ('id', False)]),
+    (['rank', '<id', 'name'], [('rank', False), ('id', True)])
+])
+def test_parse_order(order, expected):
+    assert parse_order(order) == expected
+
+
+def test_make_collection_order_multiple(client, app, admin_auth,
+                                        pagination_items):
+    """
+    Verifies that items can be ordered by more than one column.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?order_by=<rank,name&_fields=rank,name&items=100'
+    response = client.get(url, headers={'authorization': admin_auth})
+    items = [(i['properties']['rank'], i['properties']['name'], i[
+        'properties']['id']) for i in json.loads(response.body)['entities']]
+    assert items == sorted(items, key=lambda i: (-i[0], i[1], i[2]))
+
+
+def test_make_collection_order_invalid(client, app, admin_auth):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?order_by=nothing',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+@pytest.mark.parametrize('arguments', [
+    'items=-1', 'items=0', 'items=abc', 'page=0', 'page=-2', 'page=abc'
+])
+def test_make_collection_invalid_pagination(client, app, admin_auth,
+                                            arguments):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?%s' % (arguments),
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_make_collection_max_items(client, app, admin_auth, monkeypatch):
+    monkeypatch.setattr(Resources, 'settings', settings._replace(
+        collections=settings.collections._replace(max_items=10)))
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?items=10',
+                          headers={'authorization': admin_auth})
+    assert response.status != falcon.HTTP_BAD_REQUEST
+    response = client.get('/endpoint?items=11',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+    monkeypatch.setattr(Users._meta, 'max_items', 20, raising=False)
+    response = client.get('/endpoint?items=11',
+                          headers={'authorization': admin_auth})
+    assert response.status != falcon.HTTP_BAD_REQUEST
+
+
+@pytest.mark.parametrize('query, status', [
+    ('name=u8', falcon.HTTP_OK),
+    ('id=1,2', falcon.HTTP_OK),
+    ('rank=1', falcon.HTTP_BAD_REQUEST),
+    ('order_by=<rank', falcon.HTTP_OK),
+    ('order_by=name', falcon.HTTP_BAD_REQUEST),
+    ('cursor=start&order_by=name', falcon.HTTP_BAD_REQUEST)
+])
+def test_make_collection_allowed_columns(client, app, admin_auth,
+                                         pagination_items, monkeypatch,
+                                         query, status):
+    """
+    Verifies that types can restrict the columns that can be filtered and
+    sorted.
+    """
+    monkeypatch.setattr(Users._meta, 'filterable', 'name', raising=False)
+    monkeypatch.setattr(Users._meta, 'sortable', 'rank', raising=False)
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?%s' % (query),
+                          headers={'authorization': admin_auth})
+    if status == falcon.HTTP_OK:
+        assert response.status != falcon.HTTP_BAD_REQUEST
+    else:
+        assert response.status == status
+
+
+def test_make_collection_statement_timeout(client, app, admin_auth,
+                                           monkeypatch):
+    """
+    Verifies that slow queries are cancelled with a 400, leaving the
+    connection usable.
+    """
+    def build_query(model, params, projection=()):
+        sleep = SQL('(SELECT 1 FROM pg_sleep(0.5)) = 1')
+        return model.select(*projection).where(sleep)
+
+    monkeypatch.setattr(Base, 'settings', settings._replace(
+        db=settings.db._replace(statement_timeout=50)))
+    monkeypatch.setattr(Resources, 'build_query', build_query)
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint', headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+    assert Users.select().count() > 0
+
+
 def test_make_collection_query_pagination(client, app, admin_auth):
     """
     Verifies that make_collection supports pagination arguments.
@@ -308,6 +578,450 @@ def test_make_collection_pagination_headers(client, app, pagination_items,
         assert k in rel_list
 
 
+@pytest.mark.parametrize('args', [
+    {'page': 1, 'rels': ['next']},
+    {'page': 2, 'rels': ['prev', 'next']}
+])
+def test_make_collection_count_none(client, app, pagination_items,
+                                    admin_auth, args):
+    """
+    Verifies that collections can be paginated without counting the items.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?count=none&page=%s&items=1' % (args['page'])
+    response = client.get(url, headers={'authorization': admin_auth})
+    assert len(json.loads(response.body)['entities']) == 1
+    parsed_header = parse_header_links(response.headers['Link'])
+    rels = [i['rel'] for i in parsed_header]
+    assert sorted(rels) == sorted(args['rels'])
+
+
+def test_make_collection_count_none_last_page(client, app, pagination_items,
+                                              admin_auth):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    count = Users.select().count()
+    url = '/endpoint?count=none&page=%s&items=1' % (count)
+    response = client.get(url, headers={'authorization': admin_auth})
+    links = json.loads(response.body)['links']
+    rels = [i['rel'][0] for i in links]
+    assert 'next' not in rels
+    assert 'last' in rels
+
+
+def test_make_collection_count_estimate(client, app, pagination_items,
+                                        admin_auth):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?count=estimate&items=1',
+                          headers={'authorization': admin_auth})
+    rels = [i['rel'] for i in parse_header_links(response.headers['Link'])]
+    assert 'next' in rels
+    assert 'last' in rels
+
+
+def test_make_collection_count_invalid(client, app, admin_auth):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?count=maybe',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_make_collection_count_mode_type(dummy_type, custom_field):
+    """
+    Verifies that the count mode of a type is passed to its model.
+    """
+    dummy_type.count_mode = 'none'
+    model = make_model(dummy_type)
+    assert model._meta.count_mode == 'none'
+
+
+@pytest.fixture
+def embed_items(request, dummy_user):
+    items = []
+    for i in range(3):
+        item = EternalTokens(name='embed%s' % (i), user=dummy_user.id,
+                             token='embedtoken%s' % (i))
+        item.save()
+        items.append(item)
+
+    def teardown():
+        for item in items:
+            item.delete_instance()
+    request.addfinalizer(teardown)
+    return items
+
+
+def test_make_collection_embeds(client, app, admin_auth, dummy_user,
+                                embed_items):
+    resource = make_collection(EternalTokens)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?embeds=user&user_id=%s' % (dummy_user.id)
+    response = client.get(url, headers={'authorization': admin_auth})
+    entities = json.loads(response.body)['entities']
+    assert len(entities) == 3
+    for entity in entities:
+        embedded = entity['entities'][0]['properties']
+        assert embedded['id'] == dummy_user.id
+        assert embedded['name'] == dummy_user.name
+
+
+@pytest.mark.parametrize('items', [1, 3])
+def test_make_collection_embeds_queries(client, app, admin_auth, dummy_user,
+                                        embed_items, monkeypatch, items):
+    """
+    Verifies that the number of queries doesn't depend on the number of
+    embedded items.
+    """
+    resource = make_collection(EternalTokens)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?embeds=user&user_id=%s&items=%s' % (dummy_user.id, items)
+    client.get(url, headers={'authorization': admin_auth})
+    queries = []
+    execute_sql = db.execute_sql
+
+    def counting_execute_sql(sql, *args, **kwargs):
+        queries.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+    monkeypatch.setattr(db, 'execute_sql', counting_execute_sql)
+    client.get(url, headers={'authorization': admin_auth})
+    assert len([i for i in queries if '"users"' in i.split(' WHERE ')[0]]) == 1
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    collections = settings.collections._replace(stream_items=2)
+    monkeypatch.setattr(Resources, 'settings',
+                        settings._replace(collections=collections))
+
+
+@pytest.mark.parametrize('count', ['exact', 'none'])
+def test_make_collection_stream(client, app, admin_auth, pagination_items,
+                                count, monkeypatch):
+    """
+    Verifies that streamed pages are identical to the other pages.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?_fields=name&items=2&page=2&count=%s' % (count)
+    response = client.get(url, headers={'authorization': admin_auth})
+    expected = json.loads(response.body)
+    collections = settings.collections._replace(stream_items=2)
+    monkeypatch.setattr(Resources, 'settings',
+                        settings._replace(collections=collections))
+    response = client.get(url, headers={'authorization': admin_auth})
+    assert json.loads(response.body) == expected
+
+
+def test_make_collection_stream_statement_timeout(client, app, admin_auth,
+                                                  pagination_items, streaming,
+                                                  monkeypatch):
+    """
+    Verifies that the statement timeout applies while a streamed page is
+    read, and is reset once the stream ends.
+    """
+    timeouts = []
+    build_item = Resources.build_item
+
+    def showing_build_item(*args):
+        cursor = db.execute_sql('SHOW statement_timeout')
+        timeouts.append(cursor.fetchone()[0])
+        return build_item(*args)
+
+    monkeypatch.setattr(Base, 'settings', settings._replace(
+        db=settings.db._replace(statement_timeout=5000)))
+    monkeypatch.setattr(Resources, 'build_item', showing_build_item)
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?items=2',
+                          headers={'authorization': admin_auth})
+    assert len(json.loads(response.body)['entities']) == 2
+    assert timeouts == ['5s', '5s']
+    assert db.execute_sql('SHOW statement_timeout').fetchone()[0] == '0'
+
+
+def test_make_collection_stream_empty(client, app, admin_auth, streaming):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?items=2&name=nobody',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_NO_CONTENT
+
+
+@pytest.fixture
+def responses_cache(monkeypatch):
+    cache = Cache(10)
+    monkeypatch.setattr(Resources, 'responses_cache', cache)
+    return cache
+
+
+def test_make_collection_responses_cache(client, app, admin_auth,
+                                         pagination_items, responses_cache):
+    """
+    Verifies that collection responses are cached until an item changes.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?items=1&_fields=name'
+    response = client.get(url, headers={'authorization': admin_auth})
+    assert response.headers['X-Cache'] == 'MISS'
+    cached = client.get(url, headers={'authorization': admin_auth})
+    assert cached.headers['X-Cache'] == 'HIT'
+    assert cached.body == response.body
+    assert cached.headers['Link'] == response.headers['Link']
+    user = Users.get(Users.id == json.loads(response.body)['entities'][0][
+        'properties']['id'])
+    user.email = 'newmail'
+    user.save()
+    response = client.get(url, headers={'authorization': admin_auth})
+    assert response.headers['X-Cache'] == 'MISS'
+
+
+def test_make_collection_responses_cache_scope(client, app, admin_auth,
+                                               user_auth, responses_cache):
+    """
+    Verifies that users don't share cached responses with admins.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    client.get('/endpoint', headers={'authorization': admin_auth})
+    response = client.get('/endpoint', headers={'authorization': user_auth})
+    assert response.headers['X-Cache'] == 'MISS'
+
+
+def test_make_collection_responses_cache_rules(client, app, admin_auth,
+                                               responses_cache):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    client.get('/endpoint', headers={'authorization': admin_auth})
+    rule = AccessRules(level=1, model='users')
+    rule.save()
+    rule.delete_instance()
+    response = client.get('/endpoint', headers={'authorization': admin_auth})
+    assert response.headers['X-Cache'] == 'MISS'
+
+
+def test_make_collection_not_modified(client, app, admin_auth,
+                                      pagination_items, monkeypatch):
+    """
+    Verifies that a matching If-None-Match skips the collection query.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?items=1'
+    response = client.get(url, headers={'authorization': admin_auth})
+    etag = response.headers['ETag']
+    assert 'Last-Modified' in response.headers
+
+    def get_collection(*args):
+        raise AssertionError('the collection should not be read')
+
+    monkeypatch.setattr(Resources, 'get_collection', get_collection)
+    headers = {'authorization': admin_auth, 'If-None-Match': etag}
+    response = client.get(url, headers=headers)
+    assert response.status == falcon.HTTP_NOT_MODIFIED
+    assert response.body == ''
+    headers['If-None-Match'] = 'W/{}'.format(etag)
+    response = client.get(url, headers=headers)
+    assert response.status == falcon.HTTP_NOT_MODIFIED
+
+
+def test_make_collection_not_modified_changes(client, app, admin_auth,
+                                              user_auth, pagination_items):
+    """
+    Verifies that the etag changes with the items, the user and the params.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint', headers={'authorization': admin_auth})
+    etag = response.headers['ETag']
+    other = client.get('/endpoint?items=1',
+                       headers={'authorization': admin_auth})
+    assert other.headers['ETag'] != etag
+    other = client.get('/endpoint', headers={'authorization': user_auth})
+    assert other.headers['ETag'] != etag
+    user = Users.get(Users.name == pagination_items[0].name)
+    user.email = 'newmail'
+    user.save()
+    headers = {'authorization': admin_auth, 'If-None-Match': etag}
+    response = client.get('/endpoint', headers=headers)
+    assert response.status == falcon.HTTP_OK
+    assert response.headers['ETag'] != etag
+
+
+def test_make_collection_if_modified_since(client, app, admin_auth,
+                                           pagination_items):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint', headers={'authorization': admin_auth})
+    headers = {'authorization': admin_auth,
+               'If-Modified-Since': response.headers['Last-Modified']}
+    response = client.get('/endpoint', headers=headers)
+    assert response.status == falcon.HTTP_NOT_MODIFIED
+    headers['If-Modified-Since'] = 'Sat, 01 Jan 2000 00:00:00 GMT'
+    response = client.get('/endpoint', headers=headers)
+    assert response.status == falcon.HTTP_OK
+
+
+def test_make_collection_explain(client, app, admin_auth, pagination_items):
+    """
+    Verifies that admins can see the plans of the queries of a collection.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?name=u8&_explain=1',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_OK
+    queries = json.loads(response.body)['queries']
+    assert len(queries) > 0
+    assert 'u8' in queries[-1]['params']
+    assert 'Plan' in queries[-1]['plan'][0]
+
+
+def test_make_collection_explain_forbidden(client, app, user_auth):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?_explain=1',
+                          headers={'authorization': user_auth})
+    assert response.status == falcon.HTTP_FORBIDDEN
+
+
+def test_make_collection_slow_query(client, app, admin_auth, monkeypatch):
+    """
+    Verifies that collection reads slower than db.slow_query are logged with
+    their route and user, but without their parameters, and that other
+    queries are not logged.
+    """
+    clock = itertools.count()
+    messages = []
+    monkeypatch.setattr(Base, 'perf_counter', lambda: next(clock))
+    monkeypatch.setattr(Base.logger, 'warning',
+                        lambda message, *args: messages.append(message % args))
+    monkeypatch.setattr(Base, 'settings', settings._replace(
+        db=settings.db._replace(slow_query=500)))
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    client.get('/endpoint?name=secretname',
+               headers={'authorization': admin_auth})
+    assert len(messages) > 0
+    for message in messages:
+        assert 'on /endpoint by user' in message
+        assert message.split(': ', 1)[1].startswith('SELECT')
+        assert 'secretname' not in message
+
+
+def test_make_collection_slow_query_stream(client, app, admin_auth,
+                                           pagination_items, streaming,
+                                           monkeypatch):
+    """
+    Verifies that streamed pages, that use named cursors, work with the
+    slow queries log.
+    """
+    monkeypatch.setattr(Base, 'settings', settings._replace(
+        db=settings.db._replace(slow_query=500)))
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?items=2',
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_OK
+    assert len(json.loads(response.body)['entities']) == 2
+
+
+def walk_cursor(client, url, admin_auth, rel):
+    """
+    Follows the cursor links of a collection, returning the ids of the items.
+    """
+    ids = []
+    while url:
+        response = client.get(url, headers={'authorization': admin_auth})
+        body = json.loads(response.body)
+        ids += [i['properties']['id'] for i in body['entities']]
+        links = {i['rel'][0]: i['href'] for i in body['links']}
+        url = links.get(rel)
+    return ids
+
+
+@pytest.mark.parametrize('order', ['id', '>name', '<name'])
+def test_make_collection_cursor(client, app, admin_auth, pagination_items,
+                                order):
+    """
+    Verifies that cursor pagination returns every item once, in order.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?cursor=start&items=1&order_by=%s' % (order)
+    ids = walk_cursor(client, url, admin_auth, 'next')
+    query = Users.select()
+    if order == '<name':
+        query = query.order_by(Users.name.desc(), Users.id.desc())
+    else:
+        query = query.order_by(getattr(Users, order.strip('>')), Users.id)
+    assert ids == [i.id for i in query]
+
+
+@pytest.mark.parametrize('order, expected', [
+    ('<rank,name', [Users.rank.desc(), Users.name.asc(), Users.id.asc()]),
+    ('rank,<email', [Users.rank.asc(), Users.email.desc(), Users.id.desc()])
+])
+def test_make_collection_cursor_multiple(client, app, admin_auth,
+                                         pagination_items, order, expected):
+    """
+    Verifies that cursors support orderings on more than one column, in
+    both directions.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    url = '/endpoint?cursor=start&items=1&order_by=%s' % (order)
+    ids = walk_cursor(client, url, admin_auth, 'next')
+    assert ids == [i.id for i in Users.select().order_by(*expected)]
+
+
+def test_make_collection_cursor_previous(client, app, admin_auth,
+                                         pagination_items):
+    """
+    Verifies that previous cursors walk back to the first page.
+    """
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    ids = walk_cursor(client, '/endpoint?cursor=start&items=1', admin_auth,
+                      'next')
+    response = client.get('/endpoint?cursor=start&items=1',
+                          headers={'authorization': admin_auth})
+    body = json.loads(response.body)
+    links = {i['rel'][0]: i['href'] for i in body['links']}
+    assert 'previous' not in links
+    last = links['next']
+    while True:
+        response = client.get(last, headers={'authorization': admin_auth})
+        links = {i['rel'][0]: i['href']
+                 for i in json.loads(response.body)['links']}
+        if 'next' not in links:
+            break
+        last = links['next']
+    assert walk_cursor(client, last, admin_auth, 'previous') == ids[::-1]
+
+
+def test_make_collection_cursor_headers(client, app, admin_auth,
+                                        pagination_items):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?cursor=start&items=1',
+                          headers={'authorization': admin_auth})
+    rels = [i['rel'] for i in parse_header_links(response.headers['Link'])]
+    assert rels == ['next']
+
+
+@pytest.mark.parametrize('cursor', ['notacursor', 'WyJ4IiwgMV0='])
+def test_make_collection_cursor_invalid(client, app, admin_auth, cursor):
+    resource = make_collection(Users)()
+    app.add_route('/endpoint', resource)
+    response = client.get('/endpoint?cursor=%s' % (cursor),
+                          headers={'authorization': admin_auth})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
 @pytest.mark.parametrize('test_args', pytest.post_data)
 def test_make_collection_post(client, app, test_args):
     """
@@ -66,11 +66,17 @@ def test_config_has_parser(config):
 
 @pytest.mark.parametrize('options', [
     ['main', 'installed'],
-    ['db', 'name', 'user', 'password', 'host'],
+    ['db', 'name', 'user', 'password', 'host', 'slow_query',
+     'statement_timeout'],
     ['security', 'secret', 'token_expiration', 'salt_length', 'iterations',
-     'key_length'],
+     'key_length', 'algorithm', 'stateless_tokens', 'revocations_refresh'],
+    ['hashing', 'executor', 'workers', 'queue', 'retry_after'],
     ['cors', 'all_origins', 'all_methods', 'all_headers',
-     'all_credentials']
+     'all_credentials'],
+    ['collections', 'count', 'stream_items', 'search_language',
+     'max_items'],
+    ['cache', 'permissions', 'principals', 'principals_ttl', 'tokens',
+     'users', 'responses', 'responses_ttl', 'permissions_ttl']
 ])
 def test_default_config(config, options):
     """
@@ -80,3 +86,52 @@ def test_default_config(config, options):
     for option in options:
         value = config.parser.get(section, option)
         assert value != None
+
+
+def test_settings(config):
+    """
+    Verifies that the settings are parsed to their types.
+    """
+    assert config.settings.main.installed in [True, False]
+    assert config.settings.security.iterations == \
+        config.parser.getint('security', 'iterations')
+    assert isinstance(config.settings.security.previous_secrets, tuple)
+    assert isinstance(config.settings.cache.tokens, int)
+
+
+def test_settings_immutable(config):
+    with pytest.raises(AttributeError):
+        config.settings.security.secret = 'secret'
+
+
+def test_settings_environment(monkeypatch, config):
+    """
+    Verifies that environment variables override the configuration file.
+    """
+    monkeypatch.setenv('EFESTO_SECURITY_ITERATIONS', '5000')
+    monkeypatch.setenv('EFESTO_SECURITY_PREVIOUS_SECRETS', 'old, older')
+    settings = config.compile()
+    assert settings.security.iterations == 5000
+    assert settings.security.previous_secrets == ('old', 'older')
+
+
+@pytest.mark.parametrize('variable, value', [
+    ('EFESTO_SECURITY_ITERATIONS', 'many'),
+    ('EFESTO_SECURITY_ITERATIONS', '0'),
+    ('EFESTO_CACHE_TOKENS', '-1'),
+    ('EFESTO_CORS_ALL_ORIGINS', 'maybe'),
+    ('EFESTO_HASHING_EXECUTOR', 'fork')
+])
+def test_settings_invalid(monkeypatch, config, variable, value):
+    monkeypatch.setenv(variable, value)
+    with pytest.raises(ValueError):
+        config.compile()
+
+
+def test_settings_missing(config):
+    """
+    Verifies that required options can not be omitted.
+    """
+    config.parser.remove_option('security', 'secret')
+    with pytest.raises(ValueError):
+        config.compile()
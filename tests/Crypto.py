@@ -5,10 +5,15 @@
 import random
 import string
 import sys
+import threading
 
 
-from efesto.Base import config
-from efesto.Crypto import compare_hash, generate_hash, safe_str_cmp
+from efesto import Crypto
+from efesto.Base import config, settings
+from efesto.Crypto import (HashingPool, HashingPoolFull, compare_hash,
+                           generate_hash, hashers, needs_rehash,
+                           register_hasher, safe_str_cmp)
+import pytest
 
 
 sys.path.insert(0, '')
@@ -65,3 +70,79 @@ def test_compare_hash_failure():
     """
     first_key = generate_hash('mypassword')
     assert compare_hash('notmypassword', first_key) == False
+
+
+def test_compare_hash_legacy():
+    """
+    Verifies that hashes generated by previous versions are still valid.
+    """
+    old_hash = ('PBKDF2-256$1000$a1b2c3d4e5f60718$'
+                '1c0439c1b32b61eba91d52c6427f91e43976d359b283a33f')
+    assert compare_hash('mypassword', old_hash)
+    assert compare_hash('notmypassword', old_hash) == False
+
+
+@pytest.mark.parametrize('algorithm', ['PBKDF2-256', 'PBKDF2-SHA256',
+                                       'PBKDF2-SHA512'])
+def test_compare_hash_algorithms(monkeypatch, algorithm):
+    """
+    Tests the hash comparison with every registered algorithm.
+    """
+    security = settings.security._replace(algorithm=algorithm)
+    monkeypatch.setattr(Crypto, 'settings',
+                        settings._replace(security=security))
+    first_key = generate_hash('mypassword')
+    assert first_key.split('$')[0] == algorithm
+    assert compare_hash('mypassword', first_key)
+
+
+def test_compare_hash_unknown_algorithm():
+    assert compare_hash('mypassword', 'UNKNOWN$1000$salt$hash') == False
+
+
+def test_register_hasher(request):
+    """
+    Verifies that custom hashers can be registered.
+    """
+    def teardown():
+        del hashers['REVERSED']
+    request.addfinalizer(teardown)
+    register_hasher('REVERSED', lambda string, salt, iterations, length:
+                    (salt + string)[::-1])
+    assert compare_hash('mypassword', 'REVERSED$1$salt$drowssapymtlas')
+
+
+def test_needs_rehash():
+    h = generate_hash('mypassword')
+    assert needs_rehash(h) == False
+
+
+@pytest.mark.parametrize('old_hash', [
+    'PBKDF2-SHA512$1000$salt$hash',
+    'PBKDF2-256$10$salt$hash'
+])
+def test_needs_rehash_outdated(old_hash):
+    """
+    Verifies that needs_rehash detects hashes with a different algorithm or
+    less iterations.
+    """
+    assert needs_rehash(old_hash)
+
+
+def test_hashing_pool():
+    pool = HashingPool(workers=1, queue=0)
+    assert pool.run(compare_hash, 'mypassword', generate_hash('mypassword'))
+
+
+def test_hashing_pool_full():
+    """
+    Verifies that HashingPool refuses jobs when it's saturated.
+    """
+    pool = HashingPool(workers=1, queue=0)
+    event = threading.Event()
+    thread = threading.Thread(target=pool.run, args=(event.wait, ))
+    thread.start()
+    with pytest.raises(HashingPoolFull):
+        pool.run(generate_hash, 'mypassword')
+    event.set()
+    thread.join()
@@ -8,8 +8,10 @@ import sys
 
 from efesto.Base import db
 from efesto.Crypto import compare_hash
-from efesto.Models import (AccessRules, EternalTokens, Fields, Types, Users,
-                           make_model)
+from efesto.Models import (AccessRules, EternalTokens, Fields, Indexes,
+                           RevokedTokens, TableVersions, Types, Users,
+                           create_search, make_model, type_table,
+                           upgrade_tables)
 from peewee import (BooleanField, CharField, DateTimeField, FloatField,
                     ForeignKeyField, IntegerField, PrimaryKeyField, TextField)
 import pytest
@@ -90,7 +92,13 @@ def test_users_signal_on_update():
 @pytest.mark.parametrize('column_dict', [
     {'column': 'id', 'field': PrimaryKeyField},
     {'column': 'name', 'field': CharField, 'constraints': {'unique': True}},
-    {'column': 'enabled', 'field': BooleanField}
+    {'column': 'enabled', 'field': BooleanField},
+    {'column': 'max_items', 'field': IntegerField,
+     'constraints': {'null': True}},
+    {'column': 'filterable', 'field': CharField,
+     'constraints': {'null': True}},
+    {'column': 'sortable', 'field': CharField,
+     'constraints': {'null': True}}
 ])
 def test_types_model(column_dict):
     """
@@ -139,6 +147,10 @@ def test_types_pre_delete(dummy_user):
      'constraints': {'null': True}},
     {'column': 'nullable', 'field': BooleanField,
      'constraints': {'null': True}},
+    {'column': 'indexed', 'field': BooleanField,
+     'constraints': {'null': True}},
+    {'column': 'searchable', 'field': BooleanField,
+     'constraints': {'null': True}},
     {'column': 'description', 'field': CharField,
      'constraints': {'null': True}},
     {'column': 'label', 'field': CharField,
@@ -256,6 +268,52 @@ def test_eternal_tokens_io():
     user.delete_instance()
 
 
+def test_table_versions():
+    """
+    Verifies that writes increase the version of their table.
+    """
+    before = TableVersions.read(['accessrules'])\
+        .get('accessrules', (0, None))[0]
+    rule = AccessRules(level=0)
+    rule.save()
+    rule.delete_instance()
+    version, modified = TableVersions.read(['accessrules'])['accessrules']
+    assert version == before + 2
+    assert modified != None
+
+
+def test_table_versions_unversioned():
+    """
+    Verifies that writes to the tables that are not served don't keep a
+    version.
+    """
+    revocation = RevokedTokens.create(token=12345, user=1)
+    revocation.delete_instance()
+    assert 'revokedtokens' not in TableVersions.read(['revokedtokens'])
+
+
+def test_upgrade_tables():
+    """
+    Verifies that upgrade_tables adds the columns that older databases lack.
+    """
+    db.execute_sql('ALTER TABLE types DROP COLUMN count_mode')
+    db.execute_sql('ALTER TABLE fields DROP COLUMN searchable')
+    upgrade_tables()
+    assert 'count_mode' in [i.name for i in db.get_columns('types')]
+    assert 'searchable' in [i.name for i in db.get_columns('fields')]
+    upgrade_tables()
+
+
+def test_upgrade_tables_tokens_index():
+    """
+    Verifies that upgrade_tables adds the unique index on eternal tokens.
+    """
+    db.execute_sql('DROP INDEX eternaltokens_token')
+    upgrade_tables()
+    indexes = {i.name: i.unique for i in db.get_indexes('eternaltokens')}
+    assert indexes['eternaltokens_token'] == True
+
+
 def test_make_model_disabled(complex_type, complex_fields):
     """
     Verifies that make_model raises an exception when trying to generate
@@ -274,6 +332,139 @@ def test_make_model_create_table(complex_type, complex_fields):
     assert complex_type.name in db.get_tables()
 
 
+@pytest.fixture
+def indexed_type(request, complex_type, complex_fields):
+    field = Fields(name='ifield', type=complex_type.id, field_type='int',
+                   indexed=True)
+    field.save()
+    index = Indexes(name='pair', type=complex_type.id,
+                    columns='strfield, intfield DESC')
+    index.save()
+
+    def teardown():
+        Indexes.delete().where(Indexes.type == complex_type.id).execute()
+        field.delete_instance()
+    request.addfinalizer(teardown)
+    return complex_type
+
+
+def test_make_model_indexes(indexed_type):
+    """
+    Verifies that make_model creates the indexes of the fields and the type.
+    """
+    indexed_type.enabled = 1
+    model = make_model(indexed_type)
+    assert model.ifield.index == True
+    table = model._meta.db_table
+    indexes = [i.name for i in db.get_indexes(table)]
+    assert '{}_ifield'.format(table) in indexes
+    assert '{}_pair'.format(table) in indexes
+
+
+@pytest.mark.parametrize('columns', [
+    'lower(strfield)',
+    'strfield); DROP TABLE users; --',
+    'strfield DESC NULLS FIRST',
+    'nofield',
+    ''
+])
+def test_indexes_invalid_columns(complex_type, complex_fields, columns):
+    """
+    Verifies that indexes can only be on the fields of their type.
+    """
+    index = Indexes(name='invalid', type=complex_type.id, columns=columns)
+    with pytest.raises(ValueError):
+        index.save()
+
+
+@pytest.mark.parametrize('name', [
+    'pair"; DROP TABLE users; --',
+    'two words',
+    '1pair',
+    ''
+])
+def test_indexes_invalid_name(complex_type, complex_fields, name):
+    """
+    Verifies that index names must be identifiers.
+    """
+    index = Indexes(name=name, type=complex_type.id, columns='strfield')
+    with pytest.raises(ValueError):
+        index.save()
+
+
+def test_type_table(request):
+    """
+    Verifies that type_table finds the table of a generated model, also for
+    names that peewee changes.
+    """
+    custom_type = Types(name='My-Type', enabled=1)
+    custom_type.save()
+
+    def teardown():
+        custom_type.delete_instance()
+    request.addfinalizer(teardown)
+    assert type_table(custom_type) == make_model(custom_type)._meta.db_table
+
+
+def test_indexes_delete(indexed_type):
+    """
+    Verifies that deleting an index drops it.
+    """
+    indexed_type.enabled = 1
+    model = make_model(indexed_type)
+    table = model._meta.db_table
+    Indexes.get(Indexes.name == 'pair').delete_instance()
+    indexes = [i.name for i in db.get_indexes(table)]
+    assert '{}_pair'.format(table) not in indexes
+
+
+def test_make_model_search(complex_type, complex_fields, dummy_admin):
+    """
+    Verifies that make_model maintains and indexes the search column of
+    types with searchable fields.
+    """
+    field = Fields.get(Fields.name == 'strfield')
+    field.searchable = True
+    field.save()
+    complex_type.enabled = 1
+    model = make_model(complex_type)
+    assert model._meta.searchable == True
+    table = model._meta.db_table
+    assert '_search' in [i.name for i in db.get_columns(table)]
+    assert '{}__search'.format(table) in [i.name for i in
+                                          db.get_indexes(table)]
+    item = model(strfield='flowers', intfield=1, floatfield=1.0,
+                 datefield='2016-04-20', ufield='searched',
+                 owner=dummy_admin.id)
+    item.save()
+    cursor = db.execute_sql('SELECT _search::text FROM {} WHERE id = %s'
+                            .format(table), (item.id, ))
+    assert cursor.fetchone()[0] == "'flower':1"
+    item.delete_instance()
+
+
+def test_create_search_backfill(complex_type, complex_fields, dummy_admin):
+    """
+    Verifies that adding the search column fills it in for existing rows.
+    """
+    complex_type.enabled = 1
+    model = make_model(complex_type)
+    table = model._meta.db_table
+    items = []
+    for i in range(3):
+        item = model(strfield='flowers', intfield=i, floatfield=1.0,
+                     datefield='2016-04-20', ufield='backfill%s' % (i),
+                     owner=dummy_admin.id)
+        item.save()
+        items.append(item)
+    create_search(model, ['strfield'], batch=2)
+    cursor = db.execute_sql('SELECT _search::text FROM {}'.format(table))
+    assert [i[0] for i in cursor.fetchall()] == ["'flower':1"] * 3
+    for item in items:
+        item.delete_instance()
+    db.execute_sql('ALTER TABLE {} DROP COLUMN _search'.format(table))
+
+
 def test_make_model_columns(complex_type, complex_fields):
     """
     Verifies that make_model can correctly generate a model.
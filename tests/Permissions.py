@@ -3,8 +3,10 @@
     Tests permissions
 """
 import sys
+import time
 
-from efesto.Models import AccessRules, Types, Users
+from efesto.Base import settings
+from efesto.Models import AccessRules, Types, Users, permissions_cache
 
 import pytest
 
@@ -426,3 +428,93 @@ def test_users_override_by_model_create(dummy_user, item, rule):
     assert dummy_user.can('read', item) == True
     for i in actions:
         assert dummy_user.can(i, item) == False
+
+
+def test_users_filter_query(dummy_user, action, item):
+    """
+    Verifies that Users.filter_query excludes items by default.
+    """
+    model = type(item)
+    query = dummy_user.filter_query(action, model, model.select())
+    assert item.id not in [i.id for i in query]
+
+
+def test_admin_filter_query(dummy_admin, action, item):
+    """
+    Verifies that Users.filter_query does not restrict admins.
+    """
+    model = type(item)
+    query = dummy_admin.filter_query(action, model, model.select())
+    assert query.count() == model.select().count()
+
+
+def test_users_filter_query_by_model(dummy_user, action, item, rule):
+    """
+    Verifies that Users.filter_query applies model rules.
+    """
+    model = type(item)
+    model_name = getattr(item._meta, 'db_table')
+    rule_dict = {'user': dummy_user, 'level': 2, 'model': model_name}
+    rule.update_from_test(rule_dict, action, 1)
+    query = dummy_user.filter_query(action, model, model.select())
+    assert item.id in [i.id for i in query]
+    assert query.count() == model.select().count()
+
+
+def test_users_filter_query_by_item(dummy_user, action, item, rule):
+    """
+    Verifies that Users.filter_query gives precedence to item rules, exactly
+    like Users.can.
+    """
+    model = type(item)
+    model_name = getattr(item._meta, 'db_table')
+    rule_dict = {'user': dummy_user, 'level': 2, 'model': model_name}
+    rule.update_from_test(rule_dict, action, 1)
+    new_dict = {'user': dummy_user, 'level': 3, 'model': model_name,
+                'item': item.id}
+    new_dict[action] = 0
+    new_rule = AccessRules(**new_dict)
+    new_rule.save()
+    # test
+    query = dummy_user.filter_query(action, model, model.select())
+    ids = [i.id for i in query]
+    assert item.id not in ids
+    assert dummy_user.can(action, item) == False
+    for i in query:
+        assert dummy_user.can(action, i) == True
+    # tear down
+    new_rule.delete_instance()
+
+
+def test_users_can_cache(dummy_user, action, item, rule):
+    """
+    Verifies that Users.can caches decisions and that changing a rule
+    invalidates them.
+    """
+    model_name = getattr(item._meta, 'db_table')
+    assert dummy_user.can(action, item) == False
+    hits = permissions_cache.hits
+    assert dummy_user.can(action, item) == False
+    assert permissions_cache.hits == hits + 1
+    rule_dict = {'user': dummy_user, 'level': 2, 'model': model_name}
+    rule.update_from_test(rule_dict, action, 1)
+    assert dummy_user.can(action, item) == True
+
+
+def test_users_can_cache_expiry(dummy_user, action, item, rule, monkeypatch):
+    """
+    Verifies that cached decisions expire, so that rules changed by other
+    processes eventually take effect.
+    """
+    model_name = getattr(item._meta, 'db_table')
+    rule_dict = {'user': dummy_user, 'level': 2, 'model': model_name}
+    rule.update_from_test(rule_dict, action, 1)
+    assert dummy_user.can(action, item) == True
+    AccessRules.update(**{action: 0}).where(AccessRules.id == rule.id)\
+        .execute()
+    assert dummy_user.can(action, item) == True
+    now = time.time()
+    monkeypatch.setattr(time, 'time',
+                        lambda: now + settings.cache.permissions_ttl + 1)
+    assert dummy_user.can(action, item) == False
+
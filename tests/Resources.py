@@ -4,10 +4,13 @@
 import json
 import sys
 
+from efesto import Auth
 from efesto.Auth import read_token
+from efesto.Crypto import HashingPool
 from efesto.Models import (AccessRules, EternalTokens, Fields, Types, Users,
                            make_model)
-from efesto.Resources import RootResource, TokensResource, make_resource
+from efesto.Resources import (RootResource, StatsResource, TokensResource,
+                              make_resource)
 import falcon
 from peewee import FieldDescriptor, RelationDescriptor
 import pytest
@@ -131,6 +134,65 @@ def test_make_resource_get_item(client, app, admin_auth, item_with_model):
         assert body[i] == getattr(item, i)
 
 
+def test_make_resource_get_item_fields(client, app, admin_auth,
+                                       item_with_model):
+    """
+    Verifies that single resources support the _fields argument.
+    """
+    item = item_with_model[0]
+    model = item_with_model[1]
+    resource = make_resource(model)()
+    app.add_route('/endpoint/{id}', resource)
+    column = [i for i in model_columns(model) if i != 'id'][0]
+    response = client.get('/endpoint/%s?_fields=%s' % (item.id, column),
+                          headers={'authorization': admin_auth})
+    body = json.loads(response.body)['properties']
+    assert body == {'id': item.id, column: getattr(item, column)}
+
+
+def test_make_resource_get_item_not_modified(client, app, admin_auth,
+                                             item_with_model):
+    """
+    Verifies that items can be revalidated with their etag, until the table
+    changes.
+    """
+    item = item_with_model[0]
+    model = item_with_model[1]
+    resource = make_resource(model)()
+    app.add_route('/endpoint/{id}', resource)
+    url = '/endpoint/%s' % (item.id)
+    response = client.get(url, headers={'authorization': admin_auth})
+    etag = response.headers['ETag']
+    headers = {'authorization': admin_auth, 'If-None-Match': etag}
+    response = client.get(url, headers=headers)
+    assert response.status == falcon.HTTP_NOT_MODIFIED
+    item.save()
+    response = client.get(url, headers=headers)
+    assert response.status == falcon.HTTP_OK
+    assert response.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('model', [Users, Types, Fields, AccessRules,
+                                   EternalTokens])
+def test_model_descriptor(model):
+    descriptor = make_resource(model).descriptor
+    assert sorted(descriptor.columns) == sorted(model_columns(model) + [
+        '%s_id' % (i) for i in descriptor.foreign_keys])
+    for name, field in descriptor.foreign_keys.items():
+        assert descriptor.field(name) is field
+        assert descriptor.field('%s_id' % (name)) is field
+
+
+def test_model_descriptor_to_dictionary(item_with_model):
+    item = item_with_model[0]
+    descriptor = make_resource(item_with_model[1]).descriptor
+    item_dict = descriptor.to_dictionary(item)
+    for column in descriptor.columns:
+        assert item_dict[column] == getattr(item, column)
+    keys = descriptor.data_keys(['id'])
+    assert keys == [('id', 'id')]
+
+
 def test_make_resource_patch_item(client, app, admin_auth, item_with_model):
     """
     Tests the behaviour of a generated resource when a PATCH request that
@@ -374,6 +436,21 @@ def test_tokens_resource_passwd_failure(client, app, dummy_user):
     assert body['description'] == 'The credentials provided are invalid'
 
 
+def test_tokens_resource_hashing_full(client, app, dummy_user, monkeypatch):
+    """
+    Verifies that TokensResource returns a 503 when the hashing pool can't
+    accept more jobs.
+    """
+    monkeypatch.setattr(Auth, 'hashing_pool', HashingPool(workers=1,
+                                                          queue=-1))
+    resource = TokensResource()
+    data = {'username': dummy_user.name, 'password': 'sample'}
+    app.add_route('/token', resource)
+    response = client.post('/token', data)
+    assert response.status == falcon.HTTP_SERVICE_UNAVAILABLE
+    assert 'retry-after' in response.headers
+
+
 def test_tokens_resource(client, app, dummy_user):
     """
     Verifies that TokensResource returns a token when valid credentials
@@ -438,3 +515,22 @@ def test_root_resource(client, app):
     response_body = json.loads(response.body)
     assert response.status == falcon.HTTP_OK
     assert response_body == data
+
+
+def test_stats_resource(client, app, admin_auth):
+    """
+    Verifies that admins can read the counters of the caches.
+    """
+    app.add_route('/stats', StatsResource())
+    response = client.get('/stats', headers={'authorization': admin_auth})
+    stats = json.loads(response.body)
+    assert response.status == falcon.HTTP_OK
+    assert sorted(stats) == ['permissions', 'principals', 'responses',
+                             'tokens', 'users']
+    assert sorted(stats['tokens']) == ['entries', 'hits', 'misses']
+
+
+def test_stats_resource_forbidden(client, app, user_auth):
+    app.add_route('/stats', StatsResource())
+    response = client.get('/stats', headers={'authorization': user_auth})
+    assert response.status == falcon.HTTP_FORBIDDEN
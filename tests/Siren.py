@@ -17,7 +17,9 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from efesto.Siren import hinder, make_entities
+import json
+
+from efesto.Siren import hinder, hinder_stream, make_entities
 import pytest
 
 
@@ -148,3 +150,45 @@ def test_hinder_collection_entities_href(siren_collection):
     for item in result['entities']:
         item_id = item['properties']['id']
         assert '/captains/' + str(item_id) in item['href']
+
+
+def test_hinder_collection_cursors(siren_collection):
+    cursors = {'next': 'abc', 'previous': 'def'}
+    result = hinder(siren_collection, path='/captains', cursors=cursors)
+    d = {}
+    for i in result['links']:
+        d[i['rel'][0]] = i['href']
+    assert d['self'] == '/captains'
+    assert d['next'] == '/captains?cursor=abc'
+    assert d['previous'] == '/captains?cursor=def'
+
+
+def test_hinder_collection_cursors_items(siren_collection):
+    cursors = {'next': 'abc'}
+    result = hinder(siren_collection, path='/captains', cursors=cursors,
+                    items=5)
+    assert result['links'][1]['href'] == '/captains?cursor=abc&items=5'
+
+
+def test_hinder_collection_cursors_last(siren_collection):
+    result = hinder(siren_collection, path='/captains', cursors={})
+    rels = [i['rel'] for i in result['links']]
+    assert rels == [['self']]
+
+
+@pytest.mark.parametrize('chunk', [1, 2, 100])
+def test_hinder_stream(siren_collection, chunk):
+    """
+    Verifies that hinder_stream encodes collections like hinder.
+    """
+    def links(count):
+        return [{'rel': ['self'], 'href': '/captains'}]
+    chunks = hinder_stream(siren_collection, path='/captains', links=links,
+                           chunk=chunk)
+    result = json.loads(b''.join(chunks).decode('UTF-8'))
+    assert result == hinder(siren_collection, path='/captains')
+
+
+def test_hinder_stream_empty():
+    result = json.loads(b''.join(hinder_stream([])).decode('UTF-8'))
+    assert result == {'entities': [], 'properties': {'count': 0}}